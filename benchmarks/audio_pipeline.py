@@ -0,0 +1,248 @@
+"""
+Offline benchmark for the music cog's audio source chains.
+
+Runs the same sources `Music.play_next_track` builds (via `build_source`)
+against local audio fixtures — no Discord connection, no network — and
+reports what one playing guild costs:
+
+  - per-frame read() latency (first frame / ffmpeg startup reported separately)
+  - Opus encode time for non-Opus sources (what discord.py does per frame)
+  - p99 frame time and lateness against the 20 ms frame budget
+  - CPU per stream (Python thread + ffmpeg child) and streams one core can sustain
+
+Usage (from the repo root):
+
+    python benchmarks/audio_pipeline.py
+    python benchmarks/audio_pipeline.py --seconds 60 --streams 8 --realtime
+    python benchmarks/audio_pipeline.py --sources pcm passthrough --fixture song.webm
+
+To judge a new playback path, add a factory to SOURCES below.
+"""
+
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+from discord import FFmpegPCMAudio  # noqa: E402
+
+from cogs.music import FFMPEG_EXECUTABLE, TrackedSource, build_source  # noqa: E402
+
+FRAME_BUDGET = 0.020   # seconds of audio per frame
+FRAME_SAMPLES = 960    # samples per channel per frame at 48 kHz
+
+
+# ------------------------
+# SOURCES UNDER TEST
+# ------------------------
+
+def stock_pcm(path: str, volume: float) -> TrackedSource:
+    """discord.py's own PCM chain, bypassing build_source."""
+    return TrackedSource(discord.PCMVolumeTransformer(
+        FFmpegPCMAudio(path, executable=FFMPEG_EXECUTABLE, options="-vn"), volume=volume))
+
+
+# name -> factory(path, is_opus_48k) returning the TrackedSource-wrapped chain
+# (factories that never pass through Opus ignore the flag)
+SOURCES: Dict[str, Callable[[str, bool], TrackedSource]] = {
+    # Pre-passthrough chain: FFmpegPCMAudio + PCMVolumeTransformer, encoded by discord.py
+    "pcm": lambda path, opus: stock_pcm(path, 1.0),
+    # Opus remuxed straight through (falls back to PCM for other codecs)
+    "passthrough": lambda path, opus: build_source(path, opus, 1.0, before_options=""),
+    # Passthrough source after /volume: ffmpeg decodes, filters and re-encodes
+    "opus-volume": lambda path, opus: build_source(path, opus, 0.5, before_options=""),
+    # PCM path with the stock transformer at 50% volume
+    "pcm-volume": lambda path, opus: stock_pcm(path, 0.5),
+    # PCM path as playback builds it now (NormalizedPCMSource when numpy is installed)
+    "normalized": lambda path, opus: build_source(path, opus, 0.5, before_options="", passthrough=False),
+    # NormalizedPCMSource boosting: +6 dB normalisation through the limiter table
+    "normalized-boost": lambda path, opus: build_source(path, opus, 1.0, before_options="",
+                                                        passthrough=False, gain=2.0),
+}
+
+
+# ------------------------
+# FIXTURES
+# ------------------------
+
+def make_fixtures(directory: str, seconds: int) -> Dict[str, str]:
+    """Generate an Opus and an AAC fixture with ffmpeg's test source."""
+    fixtures = {"opus": os.path.join(directory, "fixture.opus"), "aac": os.path.join(directory, "fixture.m4a")}
+    codecs = {"opus": ["-c:a", "libopus", "-b:a", "128k"], "aac": ["-c:a", "aac", "-b:a", "128k"]}
+    for name, path in fixtures.items():
+        subprocess.run(
+            [FFMPEG_EXECUTABLE, "-y", "-loglevel", "error",
+             "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+             "-ac", "2", *codecs[name], path],
+            check=True,
+        )
+    return fixtures
+
+
+def probe_is_opus_48k(path: str) -> bool:
+    ffprobe = os.path.join(os.path.dirname(FFMPEG_EXECUTABLE), "ffprobe")
+    out = subprocess.run(
+        [ffprobe, "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "stream=codec_name,sample_rate", "-of", "csv=p=0", path],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    return out.startswith("opus,48000")
+
+
+# ------------------------
+# HARNESS
+# ------------------------
+
+@dataclass
+class StreamResult:
+    first_frame: float = 0.0
+    read_times: List[float] = field(default_factory=list)
+    encode_times: List[float] = field(default_factory=list)
+    lateness: List[float] = field(default_factory=list)
+    thread_cpu: float = 0.0
+
+
+def make_encoder() -> Optional[discord.opus.Encoder]:
+    try:
+        return discord.opus.Encoder()
+    except Exception as e:
+        print(f"[bench] Opus encoder unavailable ({e}); encode cost will not be measured")
+        return None
+
+
+def run_stream(factory, path: str, opus: bool, realtime: bool, result: StreamResult):
+    """Drain one source the way discord.py's AudioPlayer thread does."""
+    encoder = make_encoder()
+    cpu_start = time.thread_time()
+
+    t0 = time.perf_counter()
+    source = factory(path, opus)
+    try:
+        data = source.read()
+        result.first_frame = time.perf_counter() - t0
+        next_at = time.perf_counter()
+
+        while data:
+            if not source.is_opus() and encoder:
+                e0 = time.perf_counter()
+                encoder.encode(data, FRAME_SAMPLES)
+                result.encode_times.append(time.perf_counter() - e0)
+
+            if realtime:
+                next_at += FRAME_BUDGET
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    result.lateness.append(-delay)
+
+            r0 = time.perf_counter()
+            data = source.read()
+            if data:
+                result.read_times.append(time.perf_counter() - r0)
+    finally:
+        source.cleanup()
+        result.thread_cpu = time.thread_time() - cpu_start
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench(name: str, fixture: str, path: str, streams: int, realtime: bool) -> dict:
+    opus = probe_is_opus_48k(path)
+    factory = SOURCES[name]
+    results = [StreamResult() for _ in range(streams)]
+
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    threads = [
+        threading.Thread(target=run_stream, args=(factory, path, opus, realtime, r)) for r in results
+    ]
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    ffmpeg_cpu = (children_after.ru_utime - children_before.ru_utime
+                  + children_after.ru_stime - children_before.ru_stime)
+    python_cpu = sum(r.thread_cpu for r in results)
+    frames = sum(len(r.read_times) + 1 for r in results)
+    audio_seconds = frames * FRAME_BUDGET / streams
+
+    reads = [t for r in results for t in r.read_times]
+    encodes = [t for r in results for t in r.encode_times]
+    frame_times = [a + b for r in results for a, b in zip(r.read_times, r.encode_times or [0.0] * len(r.read_times))]
+    cpu_per_stream = (python_cpu + ffmpeg_cpu) / streams
+
+    return {
+        "source": name,
+        "fixture": fixture,
+        "streams": streams,
+        "first_frame_ms": statistics.mean(r.first_frame for r in results) * 1000,
+        "read_mean_us": statistics.mean(reads) * 1e6 if reads else 0.0,
+        "read_p99_us": percentile(reads, 99) * 1e6,
+        "encode_mean_us": statistics.mean(encodes) * 1e6 if encodes else 0.0,
+        "frame_p99_pct": percentile(frame_times, 99) / FRAME_BUDGET * 100,
+        "late_p99_ms": percentile([t for r in results for t in r.lateness], 99) * 1000,
+        "cpu_pct_per_stream": cpu_per_stream / audio_seconds * 100 if audio_seconds else 0.0,
+        "streams_per_core": audio_seconds / cpu_per_stream if cpu_per_stream else float("inf"),
+        "wall_s": wall,
+    }
+
+
+def print_table(rows: List[dict], realtime: bool):
+    header = (f"{'source':<12} {'fixture':<8} {'n':>3} {'1st ms':>7} {'read µs':>8} {'p99 µs':>8} "
+              f"{'enc µs':>7} {'p99 %20ms':>9} {'cpu %/str':>9} {'str/core':>8}")
+    if realtime:
+        header += f" {'late p99 ms':>11}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        line = (f"{r['source']:<12} {r['fixture']:<8} {r['streams']:>3} {r['first_frame_ms']:>7.1f} "
+                f"{r['read_mean_us']:>8.1f} {r['read_p99_us']:>8.1f} {r['encode_mean_us']:>7.1f} "
+                f"{r['frame_p99_pct']:>9.2f} {r['cpu_pct_per_stream']:>9.2f} {r['streams_per_core']:>8.0f}")
+        if realtime:
+            line += f" {r['late_p99_ms']:>11.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES), choices=list(SOURCES))
+    parser.add_argument("--fixture", action="append", help="audio file to use (default: generated Opus + AAC)")
+    parser.add_argument("--seconds", type=int, default=30, help="length of generated fixtures")
+    parser.add_argument("--streams", type=int, default=1, help="concurrent streams per run")
+    parser.add_argument("--realtime", action="store_true", help="pace reads at 20 ms like a live player")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.fixture:
+            fixtures = {os.path.basename(p): p for p in args.fixture}
+        else:
+            fixtures = make_fixtures(tmp, args.seconds)
+
+        rows = []
+        for fixture, path in fixtures.items():
+            for name in args.sources:
+                rows.append(bench(name, fixture, path, args.streams, args.realtime))
+        print_table(rows, args.realtime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Offline benchmark for the RPS rating replay.
+
+Generates a synthetic match log (players with hidden skill, so some K-factors
+genuinely predict better than others) and times `replay_elo` — the same
+function /rpsretune runs over the real log — against a plain Python loop
+applying `elo_delta` match by match.
+
+Each player count is a separate case: a big pool (many servers) takes the
+vectorized path, a guild-sized pool the scalar fallback.
+
+Usage (from the repo root):
+
+    python benchmarks/rps_replay.py
+    python benchmarks/rps_replay.py --matches 5000000 --players 20000 20 --k 8 16 24 32 48
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.rps import ELO_INITIAL, elo_delta, replay_elo  # noqa: E402
+
+
+def make_log(matches: int, players: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    skill = rng.normal(0, 150, players)
+    p1 = rng.integers(0, players, matches)
+    p2 = (p1 + rng.integers(1, players, matches)) % players   # never the same player twice
+    p_win = 1.0 / (1.0 + 10.0 ** ((skill[p2] - skill[p1]) / 400.0))
+    roll = rng.random(matches)
+    # A third of games tie, as in uniform RPS; skill decides the rest
+    score = np.where(roll < 1 / 3, 0.5, np.where(rng.random(matches) < p_win, 1.0, 0.0))
+    return p1, p2, score
+
+
+def replay_loop(p1, p2, score, players: int, k: float):
+    ratings = [ELO_INITIAL] * players
+    for a, b, s in zip(p1.tolist(), p2.tolist(), score.tolist()):
+        delta = elo_delta(ratings[a], ratings[b], s, k)
+        ratings[a] += delta
+        ratings[b] -= delta
+    return np.asarray(ratings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=1_000_000)
+    parser.add_argument("--players", type=int, nargs="+", default=[5_000, 20])
+    parser.add_argument("--k", type=float, nargs="+", default=[16.0, 24.0, 32.0])
+    parser.add_argument("--skip-loop", action="store_true", help="don't time the pure Python baseline")
+    args = parser.parse_args()
+
+    for players in args.players:
+        p1, p2, score = make_log(args.matches, players)
+
+        started = time.perf_counter()
+        ratings, loss = replay_elo(p1, p2, score, players, args.k)
+        vectorized = time.perf_counter() - started
+        print(f"replay_elo: {args.matches} matches, {players} players x {len(args.k)} K values "
+              f"in {vectorized:.2f} s")
+        for k, l in zip(args.k, loss.tolist()):
+            print(f"  K={k:g}: log loss {l:.4f}")
+
+        if not args.skip_loop:
+            started = time.perf_counter()
+            baseline = replay_loop(p1, p2, score, players, args.k[0])
+            loop = time.perf_counter() - started
+            print(f"python loop: one K in {loop:.2f} s "
+                  f"(max rating difference {np.abs(baseline - ratings[0]).max():.2e})")
+
+
+if __name__ == "__main__":
+    main()
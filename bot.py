@@ -6,6 +6,9 @@ import discord
 from discord.ext import commands
 import os
 
+import metrics
+from loopmonitor import LoopMonitor
+
 GUILD_ID = 1435711020680347688
 
 TOKEN = os.getenv("DISCORD_TOKEN")
@@ -14,9 +17,13 @@ intents = discord.Intents.all()
 
 bot = commands.Bot(
     command_prefix="!",
-    intents=intents
+    intents=intents,
+    tree_cls=metrics.MetricsTree
 )
 
+# Catches callbacks that hold the event loop (sync I/O, CPU work)
+loop_monitor = LoopMonitor()
+
 
 async def load_all_cogs():
     for filename in os.listdir("./cogs"):
@@ -31,6 +38,16 @@ async def load_all_cogs():
 
 @bot.event
 async def setup_hook():
+    loop_monitor.start()
+
+    # command latency, 429 counts and the /metrics endpoint
+    metrics.install(bot)
+    if metrics.METRICS_PORT:
+        try:
+            await metrics.start_server()
+        except OSError as e:
+            print(f"[bot] Metrics endpoint unavailable: {e}")
+
     # load cogs before syncing
     await load_all_cogs()
 
@@ -43,11 +60,52 @@ async def setup_hook():
         print(f" - /{cmd.name}")
 
 
+@bot.tree.command(name="looplag", description="OWNER ONLY — Show call sites that blocked the event loop")
+@discord.app_commands.guilds(discord.Object(id=GUILD_ID))
+@discord.app_commands.describe(reset="Clear the report after showing it")
+async def looplag(interaction: discord.Interaction, reset: bool = False):
+    app = await bot.application_info()
+    if interaction.user.id != app.owner.id:
+        return await interaction.response.send_message(
+            "❌ You are **not authorised** to view loop diagnostics.",
+            ephemeral=True
+        )
+
+    sites = loop_monitor.report()
+    embed = discord.Embed(
+        title="Event Loop Stalls",
+        description=f"Stalls over {loop_monitor.threshold * 1000:.0f} ms, worst total first.",
+        color=discord.Color.orange(),
+    )
+    if not sites:
+        embed.description += "\n\nNo stalls recorded."
+    for rank, site in enumerate(sites, start=1):
+        where = site.stack[-1].strip().splitlines()[0] if site.stack else site.site
+        embed.add_field(
+            name=f"#{rank} {site.site}"[:256],
+            value=(f"{site.count}× — total {site.total * 1000:.0f} ms, worst {site.worst * 1000:.0f} ms\n"
+                   f"`{where}`")[:1024],
+            inline=False,
+        )
+    if reset:
+        loop_monitor.reset()
+
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
     print("Guilds:", [g.name for g in bot.guilds])
-    
 
-bot.run(TOKEN)
+
+def main():
+    bot.run(TOKEN)
+
+
+# Voice workers are spawned processes that re-import this script as
+# __mp_main__; they must not log in a second copy of the bot
+if __name__ == "__main__":
+    main()
+
 
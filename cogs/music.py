@@ -1,15 +1,38 @@
 import asyncio
-from dataclasses import dataclass, field
-from typing import Optional, Dict, List
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from difflib import SequenceMatcher
+from typing import Optional, Dict, List, Set, AsyncIterator, Iterable, Iterator, Tuple, Callable, Awaitable
 
 import discord
-from discord import app_commands, FFmpegPCMAudio
+from discord import app_commands, FFmpegPCMAudio, FFmpegOpusAudio
 from discord.ext import commands, tasks
 from discord.ui import View
 from yt_dlp import YoutubeDL
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 
+import metrics
+
+try:
+    import numpy as np
+except ImportError:  # loudness normalisation falls back to PCMVolumeTransformer
+    np = None
+
 
 # ------------------------
 # CONFIG
@@ -25,7 +48,7 @@ SPOTIFY_CLIENT_SECRET = "1b7cfbbd75ab4e70a6d1b26a053859fd"
 # YT-DLP options
 YDL_OPTIONS = {
     "format": "ba[ext=webm][acodec=opus]/ba/best",
-    "noplaylist": False,
+    "noplaylist": True,  # playlists are expanded at /play time (see YDL_PLAYLIST_OPTIONS)
     "quiet": True,
     "no_warnings": True,
     "cachedir": False,
@@ -33,6 +56,37 @@ YDL_OPTIONS = {
     "cookiefile": "cookies.txt",
 }
 
+# yt-dlp options for Spotify -> YouTube lookups (search_youtube)
+YDL_SEARCH_OPTIONS = {"format": "bestaudio", "noplaylist": True, "quiet": True}
+
+# yt-dlp options for /search result lists
+YDL_FLAT_SEARCH_OPTIONS = {
+    "format": "bestaudio",
+    "noplaylist": True,
+    "quiet": True,
+    "extract_flat": True,
+}
+
+# yt-dlp options for listing YouTube playlists/mixes without resolving their videos
+YDL_PLAYLIST_OPTIONS = {
+    "noplaylist": False,
+    "quiet": True,
+    "no_warnings": True,
+    "cachedir": False,
+    "extract_flat": "in_playlist",
+    "lazy_playlist": True,
+    "cookiefile": "cookies.txt",
+}
+
+# Option profiles the resolver keeps pooled YoutubeDL instances for
+YDL_PROFILES = {
+    "play": YDL_OPTIONS,
+    "search": YDL_SEARCH_OPTIONS,
+    "search_flat": YDL_FLAT_SEARCH_OPTIONS,
+    "playlist": YDL_PLAYLIST_OPTIONS,
+}
+YDL_MAX_USES = 50             # recycle a pooled YoutubeDL after this many extractions
+
 # FFMPEG options
 FFMPEG_OPTIONS = {
     "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
@@ -42,11 +96,97 @@ FFMPEG_OPTIONS = {
 # Path to ffmpeg on your VPS
 FFMPEG_EXECUTABLE = "/usr/bin/ffmpeg"  # change if different on your system
 
+# Send Opus/48 kHz sources straight through (no decode, Python volume or re-encode).
+# Non-default volume on these sources is applied by an ffmpeg volume filter instead.
+OPUS_PASSTHROUGH = True
+
+# Loudness normalisation (needs numpy; measured once per track with ffmpeg's ebur128)
+LOUDNESS_NORMALIZE = True
+LOUDNESS_TARGET = -14.0       # LUFS
+LOUDNESS_MAX_BOOST = 6.0      # dB; quiet uploads are raised at most this much
+LOUDNESS_TOLERANCE = 1.0      # dB; closer than this keeps Opus passthrough
+LIMITER_THRESHOLD = 0.89      # fraction of full scale where the soft limiter starts (~-1 dBFS)
+
+# Voice worker processes. 0 keeps ffmpeg and Opus encoding in the bot process;
+# N > 0 spreads every guild's pipeline over N processes (guild_id % N).
+VOICE_WORKERS = 0
+VOICE_WORKER_BUFFER = 50      # Opus frames a worker may run ahead of playback (1 s)
+VOICE_WORKER_STALL = 10.0     # seconds without a frame before the track is treated as ended
+
+# Resolver (yt-dlp runs in worker threads, never on the event loop)
+RESOLVER_WORKERS = 4          # threads shared by all guilds
+RESOLVER_PER_GUILD = 2        # max in-flight extractions per guild
+RESOLVER_TIMEOUT = 20.0       # seconds before a single extraction is abandoned
+
+# Player (one task per guild drives every track change)
+PLAYER_RESOLVE_ATTEMPTS = 2   # tries per track when extraction times out
+PLAYER_SLOW_TRANSITION = 3.0  # seconds; slower track changes are logged
+PLAYER_LATENCY_SAMPLES = 100  # recent transitions kept per guild for /musiccache
+
+# Look-ahead (resolve upcoming tracks while the current one plays)
+LOOKAHEAD_DEPTH = 1           # how many upcoming tracks to pre-resolve
+URL_EXPIRY_MARGIN = 120       # re-resolve if the stream URL expires within this many seconds of playback
+DEFAULT_URL_TTL = 3600        # assumed lifetime of stream URLs without an expire= parameter
+
+# Resolved track cache (memory LRU in front of SQLite)
+TRACK_CACHE_DB = "music_cache.db"
+TRACK_CACHE_SIZE = 512        # entries kept in memory
+CACHE_FLUSH_INTERVAL = 2.0    # seconds between batched cache database commits
+
+# Now-playing progress bar
+PROGRESS_TICK = 5.0           # shared scheduler tick (seconds)
+PROGRESS_REFRESH = 30.0       # edit at least this often even if the bar hasn't moved
+PROGRESS_MAX_BACKOFF = 120.0  # longest per-guild edit interval after repeated 429s
+PROGRESS_BAR_LEN = 20
+
+# Queue display
+QUEUE_PAGE_SIZE = 10
+
+# Idle disconnect
+IDLE_TIMEOUT = 120            # default seconds stopped/paused/alone before leaving (per guild via /idletimeout)
+
+# Local audio cache for frequently played tracks
+AUDIO_CACHE_ENABLED = True
+AUDIO_CACHE_DIR = "audio_cache"
+AUDIO_CACHE_BUDGET = 2 * 1024 ** 3   # bytes on disk before least-recently-played files are evicted
+AUDIO_CACHE_MIN_PLAYS = 3            # plays before a track is downloaded
+AUDIO_CACHE_DOWNLOADS = 1            # concurrent background downloads
+
+# /search result cache and title autocomplete
+SEARCH_CACHE_TTL = 3600       # seconds a query's results are reused
+SEARCH_CACHE_SIZE = 256       # queries kept
+AUTOCOMPLETE_LIMIT = 25       # Discord's maximum number of choices
+
+# Queue journal (crash-safe resume after restarts)
+JOURNAL_PATH = "music_journal.log"
+JOURNAL_SNAPSHOT_PATH = "music_journal.snap"
+JOURNAL_COMPACT_OPS = 5000        # journal lines before compacting into a snapshot
+JOURNAL_CHECKPOINT_INTERVAL = 10  # seconds between playback position checkpoints
+
+# YouTube playlist import
+PLAYLIST_PAGE_SIZE = 50           # entries queued per page fetched
+PLAYLIST_MAX_ENTRIES = 1000       # stop expanding very long playlists here
+
+# Spotify collection import
+SPOTIFY_IMPORT_CONCURRENCY = 4    # YouTube searches in flight per import
+SPOTIFY_PROGRESS_INTERVAL = 3.0   # seconds between progress message edits
+
 
 # ------------------------
 # DATA STRUCTURES
 # ------------------------
 
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+
+def stream_expiry(source_url: str) -> float:
+    """Unix time at which a signed stream URL stops working."""
+    match = _EXPIRE_RE.search(source_url)
+    if match:
+        return float(match.group(1))
+    return time.time() + DEFAULT_URL_TTL
+
+
 @dataclass
 class Track:
     url: str                 # Original URL (YouTube page)
@@ -54,17 +194,1718 @@ class Track:
     title: str
     thumbnail: Optional[str]
     duration: Optional[int]  # seconds
+    expires_at: Optional[float] = None  # unix time the source_url stops working
+    acodec: Optional[str] = None        # audio codec of source_url (e.g. "opus")
+    asr: Optional[int] = None           # sample rate of source_url
+    loudness: Optional[float] = None    # integrated loudness in LUFS, measured once
+
+    @property
+    def is_opus_48k(self) -> bool:
+        return self.acodec == "opus" and self.asr == 48000
+
+    def is_fresh(self, play_at: Optional[float] = None) -> bool:
+        """True if source_url is resolved and will still be valid at `play_at`."""
+        if not self.source_url or self.expires_at is None:
+            return False
+        if play_at is None:
+            play_at = time.time()
+        return self.expires_at - play_at > URL_EXPIRY_MARGIN
+
+
+def copy_resolved(dst: Track, src: Track):
+    """Copy stream URL and metadata from one Track onto another (keeps dst.url)."""
+    dst.source_url = src.source_url
+    dst.title = src.title
+    dst.thumbnail = src.thumbnail
+    dst.duration = src.duration
+    dst.expires_at = src.expires_at
+    dst.acodec = src.acodec
+    dst.asr = src.asr
+    if src.loudness is not None:
+        dst.loudness = src.loudness
+
+
+_SPOTIFY_RE = re.compile(r"open\.spotify\.com/(?:intl-[\w-]+/)?(track|playlist|album|artist)/([A-Za-z0-9]+)")
+
+_YT_ID_RE = re.compile(r"(?:v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+
+
+_YT_LIST_RE = re.compile(r"(?:youtube\.com|youtu\.be)/\S*[?&]list=([A-Za-z0-9_-]+)")
+
+
+def youtube_video_id(url: str) -> Optional[str]:
+    """Canonical 11-character YouTube video ID for a page URL, if it is one."""
+    match = _YT_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def youtube_playlist_id(url: str) -> Optional[str]:
+    """Playlist (or mix) ID of a YouTube URL with a `list=` parameter."""
+    match = _YT_LIST_RE.search(url)
+    return match.group(1) if match else None
+
+
+class TrackQueue:
+    """Sequence of Tracks optimised for long queues.
+
+    Tracks live in a list of small blocks (deques) with a Fenwick tree over
+    the block sizes, so:
+      - popping the head is a deque popleft plus O(log blocks) bookkeeping
+      - positional get/insert/remove/move cost O(log blocks + BLOCK_SIZE)
+      - slices and pages are read with islice() without copying the queue
+      - shuffle() permutes in place
+    """
+
+    BLOCK_SIZE = 256
+
+    def __init__(self, tracks: Iterable[Track] = ()):
+        self._blocks: List[deque] = []
+        self._tree: List[int] = [0]
+        self._len = 0
+        # Called as listener(op, *args) after every mutation (used by the journal)
+        self.listener: Optional[Callable[..., None]] = None
+        self.extend(tracks)
+
+    def _notify(self, op: str, *args):
+        if self.listener:
+            self.listener(op, *args)
+
+    # -- Fenwick tree over block sizes --
+
+    def _rebuild(self):
+        n = len(self._blocks)
+        tree = [0] * (n + 1)
+        for i, block in enumerate(self._blocks, start=1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _add(self, block_index: int, delta: int):
+        i = block_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """(block index, offset in block) of a normalised position."""
+        pos, rem = 0, index
+        step = 1 << (len(self._blocks).bit_length() - 1) if self._blocks else 0
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= rem:
+                pos = nxt
+                rem -= self._tree[nxt]
+            step >>= 1
+        return pos, rem
+
+    def _normalise(self, index: int) -> int:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        return index
+
+    # -- sequence protocol --
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Track]:
+        return itertools.chain.from_iterable(self._blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1:
+                return list(self.islice(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        bi, off = self._locate(self._normalise(index))
+        return self._blocks[bi][off]
+
+    def __setitem__(self, index: int, track: Track):
+        bi, off = self._locate(self._normalise(index))
+        self._blocks[bi][off] = track
+
+    def islice(self, start: int, stop: Optional[int] = None) -> Iterator[Track]:
+        """Iterate positions [start, stop) without materialising the rest of the queue."""
+        stop = self._len if stop is None else min(stop, self._len)
+        if start >= stop:
+            return
+        bi, off = self._locate(start)
+        remaining = stop - start
+        for block in itertools.islice(self._blocks, bi, None):
+            for track in itertools.islice(block, off, off + remaining):
+                yield track
+                remaining -= 1
+            if not remaining:
+                return
+            off = 0
+
+    # -- mutation --
+
+    def append(self, track: Track):
+        if not self._blocks or len(self._blocks[-1]) >= self.BLOCK_SIZE:
+            self._blocks.append(deque())
+            self._rebuild()
+        self._blocks[-1].append(track)
+        self._add(len(self._blocks) - 1, 1)
+        self._len += 1
+        self._notify("append", track)
+
+    def extend(self, tracks: Iterable[Track]):
+        for track in tracks:
+            self.append(track)
+
+    def insert(self, index: int, track: Track):
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            return self.append(track)
+
+        bi, off = self._locate(index)
+        block = self._blocks[bi]
+        block.insert(off, track)
+        self._len += 1
+        self._notify("insert", index, track)
+        if len(block) > 2 * self.BLOCK_SIZE:
+            # Split oversized blocks so positional work stays bounded
+            half = deque(itertools.islice(block, self.BLOCK_SIZE, None))
+            for _ in range(len(half)):
+                block.pop()
+            self._blocks.insert(bi + 1, half)
+            self._rebuild()
+        else:
+            self._add(bi, 1)
+
+    def pop(self, index: int = -1) -> Track:
+        index = self._normalise(index)
+        bi, off = self._locate(index)
+        block = self._blocks[bi]
+        if off == 0:
+            track = block.popleft()
+        else:
+            track = block[off]
+            del block[off]
+        self._len -= 1
+        if block:
+            self._add(bi, -1)
+        else:
+            del self._blocks[bi]
+            self._rebuild()
+        self._notify("pop", index)
+        return track
+
+    def popleft(self) -> Track:
+        return self.pop(0)
+
+    def move(self, src: int, dst: int):
+        """Move the track at position `src` so it ends up at position `dst`."""
+        self.insert(dst, self.pop(src))
+
+    def shuffle(self, start: int = 0):
+        """Shuffle positions [start, len) in place (Fisher–Yates)."""
+        for i in range(self._len - 1, start, -1):
+            j = random.randint(start, i)
+            if i != j:
+                self[i], self[j] = self[j], self[i]
+        self._notify("set", list(self))
+
+    def clear(self):
+        self._blocks = []
+        self._tree = [0]
+        self._len = 0
+        self._notify("clear")
 
 
 @dataclass
 class GuildMusicState:
-    queue: List[Track] = field(default_factory=list)
+    queue: TrackQueue = field(default_factory=TrackQueue)
     current: Optional[Track] = None
     volume: float = 1.0
     text_channel: Optional[discord.abc.Messageable] = None
     now_playing_msg: Optional[discord.Message] = None
-    idle_time: int = 0
+    idle_timeout: int = IDLE_TIMEOUT
     voice_channel_id: Optional[int] = None
+    started_at: Optional[float] = None  # unix time the current track started
+    lookahead_depth: int = LOOKAHEAD_DEPTH
+    lookahead_task: Optional[asyncio.Task] = None
+    resolving: Dict[int, asyncio.Task] = field(default_factory=dict)  # id(track) -> extraction
+    events: asyncio.Queue = field(default_factory=asyncio.Queue)  # (event, arg, posted) for the player
+    player_task: Optional[asyncio.Task] = None
+    transitions: deque = field(default_factory=lambda: deque(maxlen=PLAYER_LATENCY_SAMPLES))
+
+
+# ------------------------
+# RESOLVER
+# ------------------------
+
+class ResolveCancelled(Exception):
+    """Raised when an extraction was cancelled because its result is no longer wanted."""
+
+
+class YoutubeDLPool:
+    """Long-lived YoutubeDL instances, one pool per option profile.
+
+    Building a YoutubeDL re-initialises every extractor and re-reads the
+    cookie file, so instances are reused. Each extraction checks one out
+    exclusively (they are not thread-safe), and it is closed instead of
+    returned after YDL_MAX_USES uses, after an error, or once the profile's
+    cookie file has changed on disk.
+
+    Each instance works on a private copy of the cookie file: YoutubeDL
+    saves its cookie jar on close(), which would otherwise rewrite the
+    shared file and make every other idle instance look stale.
+    """
+
+    def __init__(self, profiles: Dict[str, dict] = YDL_PROFILES, max_uses: int = YDL_MAX_USES):
+        self.profiles = profiles
+        self.max_uses = max_uses
+        self.lock = threading.Lock()
+        # profile -> idle [ydl, uses, cookie mtime, private cookie copy]
+        self.idle: Dict[str, List[list]] = {name: [] for name in profiles}
+
+    def _cookie_mtime(self, profile: str) -> Optional[float]:
+        path = self.profiles[profile].get("cookiefile")
+        try:
+            return os.path.getmtime(path) if path else None
+        except OSError:
+            return None
+
+    def _checkout(self, profile: str) -> list:
+        mtime = self._cookie_mtime(profile)
+        stale = []
+        with self.lock:
+            idle = self.idle[profile]
+            while idle:
+                entry = idle.pop()
+                if entry[2] == mtime:
+                    break
+                stale.append(entry)
+            else:
+                entry = None
+        for old in stale:
+            self._close(old)
+        if entry is None:
+            entry = self._create(profile)
+        return entry
+
+    def _create(self, profile: str) -> list:
+        options = dict(self.profiles[profile])
+        source = options.get("cookiefile")
+        # Read after any stale instances were closed, so the new one isn't born stale
+        mtime = self._cookie_mtime(profile)
+        private = None
+        if source and mtime is not None:
+            fd, private = tempfile.mkstemp(prefix="ytdl-cookies-", suffix=".txt")
+            os.close(fd)
+            shutil.copyfile(source, private)
+            options["cookiefile"] = private
+        return [YoutubeDL(options), 0, mtime, private]
+
+    def _checkin(self, profile: str, entry: list, failed: bool):
+        entry[1] += 1
+        if failed or entry[1] >= self.max_uses:
+            return self._close(entry)
+        with self.lock:
+            self.idle[profile].append(entry)
+
+    @staticmethod
+    def _close(entry: list):
+        try:
+            entry[0].close()
+        except Exception:
+            pass
+        if entry[3]:
+            try:
+                os.remove(entry[3])
+            except OSError:
+                pass
+
+    def extract_info(self, query: str, profile: str) -> dict:
+        # Runs in a worker thread
+        entry = self._checkout(profile)
+        failed = True
+        try:
+            info = entry[0].extract_info(query, download=False)
+            failed = False
+            return info
+        finally:
+            self._checkin(profile, entry, failed)
+
+    def open_playlist(self, query: str, profile: str = "playlist") -> Tuple[list, dict, Iterator[dict]]:
+        """Start listing a playlist without processing its entries (worker thread).
+
+        Returns (pool entry, playlist info, lazy entry iterator); the YoutubeDL
+        stays checked out until release() since the iterator fetches further
+        pages through it.
+        """
+        entry = self._checkout(profile)
+        try:
+            ydl = entry[0]
+            info = ydl.extract_info(query, download=False, process=False)
+            # A watch?v=...&list=... URL hands off to the playlist extractor
+            for _ in range(3):
+                if info.get("_type") not in ("url", "url_transparent"):
+                    break
+                info = ydl.extract_info(info["url"], download=False, process=False, ie_key=info.get("ie_key"))
+        except Exception:
+            self._checkin(profile, entry, failed=True)
+            raise
+        return entry, info, iter(info.get("entries") or ())
+
+    @staticmethod
+    def next_page(entries: Iterator[dict], size: int) -> List[dict]:
+        # Worker thread; may fetch the next continuation page from YouTube
+        return list(itertools.islice(entries, size))
+
+    def release(self, profile: str, entry: list, failed: bool = False):
+        self._checkin(profile, entry, failed)
+
+    def close(self):
+        with self.lock:
+            entries = [e for idle in self.idle.values() for e in idle]
+            for idle in self.idle.values():
+                idle.clear()
+        for entry in entries:
+            self._close(entry)
+
+
+class TrackResolver:
+    """Runs yt-dlp extraction in a bounded thread pool with an async API.
+
+    Each guild may only have RESOLVER_PER_GUILD extractions in flight; extra
+    requests wait their turn. Every request has its own timeout, and a
+    guild's pending requests can be cancelled at once (e.g. on /leave), or
+    only those made for one purpose (e.g. "playback" on /skip, leaving a
+    playlist import's searches running).
+    """
+
+    def __init__(self, workers: int = RESOLVER_WORKERS, per_guild: int = RESOLVER_PER_GUILD,
+                 timeout: float = RESOLVER_TIMEOUT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdl")
+        self.ydl_pool = YoutubeDLPool()
+        self.per_guild = per_guild
+        self.timeout = timeout
+        self.slots: Dict[int, asyncio.Semaphore] = {}
+        self.pending: Dict[int, Dict[asyncio.Task, str]] = {}  # guild -> {task: purpose}
+
+    async def extract(self, guild_id: int, query: str, profile: str = "play",
+                      timeout: Optional[float] = None, purpose: str = "other") -> dict:
+        """Extract info for `query` with the given YDL_PROFILES entry, off the event loop.
+
+        Raises ResolveCancelled if cancel_guild() was called (for this
+        purpose) while waiting, asyncio.TimeoutError on timeout, or whatever
+        yt-dlp raised.
+        """
+        task = asyncio.ensure_future(self._run(guild_id, query, profile, timeout or self.timeout))
+        pending = self.pending.setdefault(guild_id, {})
+        pending[task] = purpose
+        try:
+            # wait() never raises for the inner task, so a cancel_guild() call
+            # can be told apart from the caller itself being cancelled
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            pending.pop(task, None)
+
+        if task.cancelled():
+            raise ResolveCancelled(query)
+        return task.result()
+
+    async def _run(self, guild_id: int, query: str, profile: str, timeout: float) -> dict:
+        return await self._call(guild_id, profile, timeout, self.ydl_pool.extract_info, query, profile)
+
+    async def extract_pages(self, guild_id: int, url: str, page_size: int,
+                            timeout: Optional[float] = None) -> AsyncIterator[Tuple[dict, List[dict]]]:
+        """Yield (playlist info, page of flat entries), fetching pages only as they are consumed.
+
+        Each page takes a guild slot only while it is being fetched, so
+        playback resolution is not starved by a long listing.
+        """
+        timeout = timeout or self.timeout
+        entry, info, entries = await self._call(
+            guild_id, "playlist", timeout, self.ydl_pool.open_playlist, url, "playlist",
+        )
+        try:
+            while True:
+                page = await self._call(guild_id, "playlist", timeout, self.ydl_pool.next_page, entries, page_size)
+                if not page:
+                    break
+                yield info, page
+        except GeneratorExit:
+            # Consumer stopped early; the instance itself is still fine
+            self.ydl_pool.release("playlist", entry)
+            raise
+        except BaseException:
+            # A timed-out page may still be running in its worker thread
+            self.ydl_pool.release("playlist", entry, failed=True)
+            raise
+        else:
+            self.ydl_pool.release("playlist", entry)
+
+    async def _call(self, guild_id: int, profile: str, timeout: float, func, *args):
+        sem = self.slots.get(guild_id)
+        if sem is None:
+            sem = asyncio.Semaphore(self.per_guild)
+            self.slots[guild_id] = sem
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            async with sem:
+                loop = asyncio.get_running_loop()
+                fut = loop.run_in_executor(self.executor, func, *args)
+                # The worker thread can't be interrupted; on timeout/cancel its
+                # result is simply dropped and the thread goes back to the pool.
+                result = await asyncio.wait_for(fut, timeout)
+                outcome = "ok"
+                return result
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            metrics.YTDL_RESOLVE.observe(time.perf_counter() - start, profile, outcome)
+
+    def cancel_guild(self, guild_id: int, purpose: Optional[str] = None):
+        """Cancel the guild's pending extractions, or only those made for `purpose`."""
+        for task, task_purpose in list(self.pending.get(guild_id, {}).items()):
+            if purpose is None or task_purpose == purpose:
+                task.cancel()
+
+    def shutdown(self):
+        for guild_id in list(self.pending):
+            self.cancel_guild(guild_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.ydl_pool.close()
+
+
+# ------------------------
+# PROGRESS SCHEDULER
+# ------------------------
+
+@dataclass
+class ProgressEntry:
+    message: discord.Message
+    track: Track
+    started: float                   # loop time playback started (shifted forward while paused)
+    last_tick: float
+    next_edit: float
+    interval: float = PROGRESS_TICK  # grows on 429s, shrinks back on success
+    last_bar: Optional[str] = None
+    last_edit: float = 0.0
+
+
+class ProgressScheduler:
+    """Owns every now-playing progress bar.
+
+    One task wakes every PROGRESS_TICK and edits all due messages together.
+    Each guild has at most one entry; starting a new one replaces the old.
+    Edits are skipped while the bar is unchanged (up to PROGRESS_REFRESH),
+    and rate limits back off both the guild's interval and the whole tick.
+    """
+
+    def __init__(self, cog: "Music"):
+        self.cog = cog
+        self.entries: Dict[int, ProgressEntry] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.paused_until = 0.0
+
+    def start(self, guild_id: int, message: discord.Message, track: Track, elapsed: float = 0.0):
+        now = asyncio.get_running_loop().time()
+        self.entries[guild_id] = ProgressEntry(
+            message=message, track=track, started=now - elapsed, last_tick=now, next_edit=now + PROGRESS_TICK,
+        )
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def cancel(self, guild_id: int):
+        self.entries.pop(guild_id, None)
+
+    def stop(self):
+        self.entries.clear()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while self.entries:
+            await asyncio.sleep(PROGRESS_TICK)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"[Music] Progress scheduler error: {e}")
+
+    def render(self, entry: ProgressEntry, elapsed: float) -> Tuple[str, str]:
+        """(bar key used to detect changes, full progress text)."""
+        fmt = self.cog.format_duration
+        duration = entry.track.duration
+        if duration:
+            filled_len = min(int((elapsed / duration) * PROGRESS_BAR_LEN), PROGRESS_BAR_LEN)
+            bar = "█" * filled_len + "─" * (PROGRESS_BAR_LEN - filled_len)
+            return bar, f"[{bar}] {fmt(elapsed)} / {fmt(duration)}"
+        return "", f"Elapsed: {fmt(elapsed)}"
+
+    async def tick(self):
+        now = asyncio.get_running_loop().time()
+        if now < self.paused_until:
+            return
+
+        due = []
+        for guild_id, entry in list(self.entries.items()):
+            guild = self.cog.bot.get_guild(guild_id)
+            vc = guild.voice_client if guild else None
+            if not vc or not vc.is_connected() or not (vc.is_playing() or vc.is_paused()):
+                self.entries.pop(guild_id, None)
+                continue
+
+            if vc.is_paused():
+                # Don't count paused time as progress
+                entry.started += now - entry.last_tick
+            entry.last_tick = now
+
+            if now < entry.next_edit:
+                continue
+            entry.next_edit = now + entry.interval
+
+            bar, text = self.render(entry, now - entry.started)
+            if bar == entry.last_bar and now - entry.last_edit < PROGRESS_REFRESH:
+                continue
+            due.append((guild_id, entry, bar, text))
+
+        if due:
+            await asyncio.gather(*(self.edit(*args) for args in due))
+
+    async def edit(self, guild_id: int, entry: ProgressEntry, bar: str, text: str):
+        track = entry.track
+        embed = discord.Embed(
+            title="Now Playing",
+            description=f"[{track.title}]({track.url})",
+            color=discord.Color.blurple(),
+        )
+        if track.thumbnail:
+            embed.set_thumbnail(url=track.thumbnail)
+        embed.add_field(name="Progress", value=text, inline=False)
+
+        try:
+            await entry.message.edit(embed=embed)
+        except discord.HTTPException as e:
+            if e.status == 429:
+                retry_after = getattr(e, "retry_after", None) or entry.interval
+                self.paused_until = asyncio.get_running_loop().time() + retry_after
+                entry.interval = min(entry.interval * 2, PROGRESS_MAX_BACKOFF)
+                return
+            # Message deleted or otherwise uneditable
+            if self.entries.get(guild_id) is entry:
+                self.entries.pop(guild_id, None)
+            return
+        except Exception:
+            if self.entries.get(guild_id) is entry:
+                self.entries.pop(guild_id, None)
+            return
+
+        entry.last_bar = bar
+        entry.last_edit = asyncio.get_running_loop().time()
+        entry.interval = max(PROGRESS_TICK, entry.interval / 2)
+
+
+# ------------------------
+# PLAYBACK SOURCES
+# ------------------------
+
+class TrackedSource(discord.AudioSource):
+    """Wraps the real audio source and counts 20 ms frames to know the play position."""
+
+    def __init__(self, inner: discord.AudioSource, offset: float = 0.0, passthrough: bool = False):
+        self.inner = inner
+        self.offset = offset          # seconds into the track where this source starts
+        self.passthrough = passthrough
+        self.frames = 0
+        self.created = time.perf_counter()  # ffmpeg is spawned when `inner` is built
+
+    @property
+    def position(self) -> float:
+        return self.offset + self.frames * 0.02
+
+    def read(self) -> bytes:
+        data = self.inner.read()
+        if data:
+            if not self.frames:
+                metrics.FFMPEG_FIRST_FRAME.observe(
+                    time.perf_counter() - self.created, "opus" if self.inner.is_opus() else "pcm",
+                )
+            self.frames += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def cleanup(self):
+        self.inner.cleanup()
+
+
+def soft_limit(samples: "np.ndarray"):
+    """Soft knee in place on float samples: linear below LIMITER_THRESHOLD, tanh-compressed above it."""
+    threshold = LIMITER_THRESHOLD * 32767
+    knee = 32767 - threshold
+    over = np.abs(samples) > threshold
+    loud = samples[over]
+    samples[over] = np.sign(loud) * (threshold + knee * np.tanh((np.abs(loud) - threshold) / knee))
+
+
+class NormalizedPCMSource(discord.AudioSource):
+    """PCM volume + loudness normalisation + soft limiter, vectorised with NumPy.
+
+    Drop-in replacement for PCMVolumeTransformer: `volume` is the user volume
+    and `gain` the per-track normalisation gain (both linear). Gain changes
+    are ramped across one frame to avoid clicks. Attenuation is a plain
+    multiply; a net boost goes through a 64K-entry table mapping every int16
+    sample to its gained and limited value, rebuilt only when the gain
+    changes, so a boosted frame costs one gather instead of a limiter pass.
+    """
+
+    def __init__(self, original: discord.AudioSource, volume: float = 1.0, gain: float = 1.0):
+        if original.is_opus():
+            raise discord.ClientException("NormalizedPCMSource needs a PCM source.")
+        self.original = original
+        self.volume = volume
+        self.gain = gain
+        self._applied = volume * gain
+        self._table = None
+        self._table_gain = None
+
+    def table(self, gain: float) -> "np.ndarray":
+        """int16 output for every input sample, indexed by the sample's uint16 bit pattern."""
+        if self._table_gain != gain:
+            samples = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.float32) * gain
+            soft_limit(samples)
+            self._table = samples.astype(np.int16)
+            self._table_gain = gain
+        return self._table
+
+    def cleanup(self):
+        self.original.cleanup()
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        target = self.volume * self.gain
+        if not data or (target == 1.0 and self._applied == 1.0):
+            return data
+
+        if target == self._applied and target > 1.0:
+            return np.take(self.table(target), np.frombuffer(data, dtype=np.uint16)).tobytes()
+
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if target != self._applied:
+            # Per-sample ramp; stereo samples are interleaved so repeat each step twice
+            ramp = np.linspace(self._applied, target, len(samples) // 2, dtype=np.float32)
+            samples *= np.repeat(ramp, 2)
+            # Net attenuation can't clip, so only a ramp involving a boost is limited
+            if max(target, self._applied) > 1.0:
+                soft_limit(samples)
+            self._applied = target
+        else:
+            samples *= target
+
+        return samples.astype(np.int16).tobytes()
+
+
+def loudness_gain(loudness: Optional[float]) -> float:
+    """Linear gain that brings a track to LOUDNESS_TARGET (1.0 if unknown or close enough)."""
+    if loudness is None or not LOUDNESS_NORMALIZE or np is None:
+        return 1.0
+    gain_db = min(LOUDNESS_TARGET - loudness, LOUDNESS_MAX_BOOST)
+    if abs(gain_db) < LOUDNESS_TOLERANCE:
+        return 1.0
+    return 10 ** (gain_db / 20)
+
+
+def build_source(source_url: str, opus_48k: bool, volume: float, start_at: float = 0.0,
+                 before_options: str = FFMPEG_OPTIONS["before_options"],
+                 passthrough: bool = OPUS_PASSTHROUGH, gain: float = 1.0) -> TrackedSource:
+    """Build the ffmpeg source chain used for playback.
+
+    Opus/48 kHz streams that need no loudness correction are remuxed straight
+    through at default volume, or re-encoded by ffmpeg with a volume filter
+    otherwise. Everything else is decoded to PCM and scaled by
+    NormalizedPCMSource (or PCMVolumeTransformer without numpy).
+    """
+    if start_at:
+        before_options = f"-ss {start_at:.2f} {before_options}".strip()
+
+    if passthrough and opus_48k and gain == 1.0:
+        if volume == 1.0:
+            inner = FFmpegOpusAudio(
+                source_url,
+                codec="copy",
+                executable=FFMPEG_EXECUTABLE,
+                before_options=before_options,
+                options=FFMPEG_OPTIONS["options"],
+            )
+        else:
+            inner = FFmpegOpusAudio(
+                source_url,
+                executable=FFMPEG_EXECUTABLE,
+                before_options=before_options,
+                options=f"{FFMPEG_OPTIONS['options']} -filter:a volume={volume:.2f}",
+            )
+        return TrackedSource(inner, offset=start_at, passthrough=True)
+
+    pcm = FFmpegPCMAudio(
+        source_url,
+        executable=FFMPEG_EXECUTABLE,
+        before_options=before_options,
+        options=FFMPEG_OPTIONS["options"],
+    )
+    if np is not None:
+        return TrackedSource(NormalizedPCMSource(pcm, volume=volume, gain=gain), offset=start_at)
+    return TrackedSource(discord.PCMVolumeTransformer(pcm, volume=volume), offset=start_at)
+
+
+# ------------------------
+# VOICE WORKERS
+# ------------------------
+
+def _voice_worker_main(conn):
+    """Entry point of a voice worker process.
+
+    Owns the ffmpeg pipelines (and Opus encoding for PCM sources) of the
+    streams it is given and pushes ready Opus packets back over `conn`,
+    never more than the credits the bot process has granted.
+    """
+    send_lock = threading.Lock()
+    streams: Dict[int, dict] = {}
+
+    def send(msg):
+        with send_lock:
+            try:
+                conn.send(msg)
+            except (OSError, EOFError):
+                pass
+
+    def pump(stream_id: int, stream: dict):
+        encoder = None
+        try:
+            while not stream["stop"].is_set():
+                if not stream["credits"].acquire(timeout=0.5):
+                    continue
+                with stream["lock"]:
+                    source = stream["source"]
+                    data = source.read()
+                    is_opus = source.is_opus()
+                if not data:
+                    break
+                if not is_opus:
+                    encoder = encoder or discord.opus.Encoder()
+                    data = encoder.encode(data, 960)
+                send(("data", stream_id, data))
+        except Exception as e:
+            print(f"[Music] Voice worker stream {stream_id} failed: {e}")
+        finally:
+            send(("eof", stream_id))
+            with stream["lock"]:
+                stream["source"].cleanup()
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        op = msg[0]
+        if op == "shutdown":
+            break
+
+        stream_id = msg[1]
+        if op == "open":
+            params = msg[2]
+            try:
+                source = build_source(**params)
+            except Exception as e:
+                print(f"[Music] Voice worker could not open stream {stream_id}: {e}")
+                send(("eof", stream_id))
+                continue
+            stream = {
+                "params": params,
+                "source": source,
+                "credits": threading.Semaphore(VOICE_WORKER_BUFFER),
+                "stop": threading.Event(),
+                "lock": threading.Lock(),
+            }
+            streams[stream_id] = stream
+            threading.Thread(target=pump, args=(stream_id, stream), daemon=True).start()
+            continue
+
+        stream = streams.get(stream_id)
+        if stream is None:
+            continue
+        if op == "credit":
+            stream["credits"].release(msg[2])
+        elif op in ("volume", "gain"):
+            with stream["lock"]:
+                source = stream["source"]
+                if hasattr(source.inner, op):
+                    setattr(source.inner, op, msg[2])
+                elif source.passthrough:
+                    # ffmpeg owns the volume: restart it where playback is
+                    params = stream["params"]
+                    params.update({op: msg[2], "start_at": source.position})
+                    stream["source"] = build_source(**params)
+                    source.cleanup()
+        elif op == "close":
+            stream["stop"].set()
+            streams.pop(stream_id, None)
+
+    for stream in streams.values():
+        stream["stop"].set()
+
+
+class RemoteOpusSource(discord.AudioSource):
+    """Opus packets produced by a voice worker, read by discord.py's player thread."""
+
+    CREDIT_BATCH = 10
+
+    def __init__(self, worker: "VoiceWorker", stream_id: int):
+        self.worker = worker
+        self.stream_id = stream_id
+        self.packets: deque = deque()
+        self.cond = threading.Condition()
+        self.eof = False
+        self.consumed = 0
+
+    def feed(self, packet: bytes):
+        with self.cond:
+            self.packets.append(packet)
+            self.cond.notify()
+
+    def finish(self):
+        with self.cond:
+            self.eof = True
+            self.cond.notify()
+
+    def read(self) -> bytes:
+        with self.cond:
+            self.cond.wait_for(lambda: self.packets or self.eof, timeout=VOICE_WORKER_STALL)
+            if not self.packets:
+                return b""
+            packet = self.packets.popleft()
+
+        self.consumed += 1
+        if self.consumed % self.CREDIT_BATCH == 0:
+            self.worker.send(("credit", self.stream_id, self.CREDIT_BATCH))
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def set(self, attribute: str, value: float):
+        """Forward a volume or gain change to the worker-side source."""
+        self.worker.send((attribute, self.stream_id, value))
+
+    def cleanup(self):
+        self.worker.streams.pop(self.stream_id, None)
+        self.worker.send(("close", self.stream_id))
+
+
+class VoiceWorker:
+    """Bot-side handle of one worker process: a pipe, a reader thread and its streams."""
+
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_voice_worker_main, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.send_lock = threading.Lock()
+        self.streams: Dict[int, RemoteOpusSource] = {}
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def send(self, msg):
+        with self.send_lock:
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError, BrokenPipeError):
+                pass
+
+    def read_loop(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            stream = self.streams.get(msg[1])
+            if stream is None:
+                continue
+            if msg[0] == "data":
+                stream.feed(msg[2])
+            elif msg[0] == "eof":
+                stream.finish()
+
+        # Worker died: end whatever it was playing
+        for stream in list(self.streams.values()):
+            stream.finish()
+
+    def stop(self):
+        self.send(("shutdown", 0))
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class VoicePool:
+    """Fixed set of voice worker processes; each guild always maps to the same one."""
+
+    def __init__(self, workers: int = VOICE_WORKERS):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.workers = [VoiceWorker(self.ctx) for _ in range(workers)]
+        self.next_id = itertools.count(1)
+
+    def open(self, guild_id: int, params: dict) -> RemoteOpusSource:
+        index = guild_id % len(self.workers)
+        worker = self.workers[index]
+        if not worker.is_alive():
+            print(f"[Music] Restarting voice worker {index}")
+            worker.stop()
+            worker = self.workers[index] = VoiceWorker(self.ctx)
+
+        stream_id = next(self.next_id)
+        source = RemoteOpusSource(worker, stream_id)
+        worker.streams[stream_id] = source
+        worker.send(("open", stream_id, params))
+        return source
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+# ------------------------
+# IDLE TIMERS
+# ------------------------
+
+class IdleTimers:
+    """Per-guild idle deadlines kept in a heap and served by one sleeping task.
+
+    Only guilds with an armed deadline cost anything: the task sleeps until the
+    earliest deadline (or until an earlier one is armed) and calls `on_expire`
+    for each guild whose deadline passes. Disarmed entries are dropped lazily.
+    """
+
+    def __init__(self, on_expire: Callable[[int], Awaitable[None]]):
+        self.on_expire = on_expire
+        self.heap: List[Tuple[float, int]] = []
+        self.deadlines: Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def is_armed(self, guild_id: int) -> bool:
+        return guild_id in self.deadlines
+
+    def arm(self, guild_id: int, timeout: float, restart: bool = False):
+        """Start the guild's countdown, unless one is already running (or `restart`)."""
+        if guild_id in self.deadlines and not restart:
+            return
+        deadline = asyncio.get_running_loop().time() + timeout
+        self.deadlines[guild_id] = deadline
+        heapq.heappush(self.heap, (deadline, guild_id))
+
+        # Drop stale entries once they dominate the heap
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(d, g) for g, d in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        elif self.heap[0] == (deadline, guild_id):
+            self.wakeup.set()
+
+    def disarm(self, guild_id: int):
+        self.deadlines.pop(guild_id, None)
+
+    def stop(self):
+        self.deadlines.clear()
+        self.heap.clear()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while self.deadlines:
+            deadline, guild_id = self.heap[0]
+            if self.deadlines.get(guild_id) != deadline:
+                heapq.heappop(self.heap)  # disarmed or re-armed since
+                continue
+
+            delay = deadline - loop.time()
+            if delay <= 0:
+                heapq.heappop(self.heap)
+                del self.deadlines[guild_id]
+                try:
+                    await self.on_expire(guild_id)
+                except Exception as e:
+                    print(f"[Music] Idle disconnect failed in guild {guild_id}: {e}")
+                continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+# ------------------------
+# QUEUE VIEW
+# ------------------------
+
+class QueueView(View):
+    """Button-paginated /queue. Only the visible page is ever formatted."""
+
+    def __init__(self, queue: TrackQueue):
+        super().__init__(timeout=180)
+        self.queue = queue
+        self.page = 0
+
+    def page_count(self) -> int:
+        return max(1, math.ceil(len(self.queue) / QUEUE_PAGE_SIZE))
+
+    def render(self) -> discord.Embed:
+        # The queue may have changed since the last click
+        self.page = min(self.page, self.page_count() - 1)
+        start = self.page * QUEUE_PAGE_SIZE
+
+        lines = []
+        for i, track in enumerate(self.queue.islice(start, start + QUEUE_PAGE_SIZE), start=start + 1):
+            title = track.title or track.url
+            if len(title) > 80:
+                title = title[:77] + "..."
+            lines.append(f"**{i}.** [{title}]({track.url})")
+
+        embed = discord.Embed(title="Queue", color=discord.Color.green())
+        embed.description = "\n".join(lines) or "Queue is empty!"
+        embed.set_footer(text=f"Page {self.page + 1}/{self.page_count()} • {len(self.queue)} song(s)")
+        return embed
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        self.page = max(0, min(page, self.page_count() - 1))
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="⏮", style=discord.ButtonStyle.secondary)
+    async def first_page(self, interaction_btn, _):
+        await self.show(interaction_btn, 0)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.primary)
+    async def previous_page(self, interaction_btn, _):
+        await self.show(interaction_btn, self.page - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction_btn, _):
+        await self.show(interaction_btn, self.page + 1)
+
+    @discord.ui.button(label="⏭", style=discord.ButtonStyle.secondary)
+    async def last_page(self, interaction_btn, _):
+        await self.show(interaction_btn, self.page_count() - 1)
+
+
+# ------------------------
+# QUEUE JOURNAL
+# ------------------------
+
+class QueueJournal:
+    """Append-only log of queue mutations with periodic snapshot compaction.
+
+    Each line is a compact JSON array `[op, guild_id, ...]`. On startup the
+    snapshot is loaded and the log replayed on top of it; a torn last line
+    from a crash is ignored. compact() writes a new snapshot atomically and
+    truncates the log.
+
+    Snapshot and log carry a generation number (the log in a `["gen", n]`
+    header line). A crash after a new snapshot is published but before the
+    log is truncated leaves a log from an older generation, which is then
+    skipped instead of replayed on top of the snapshot that contains it.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, snapshot_path: str = JOURNAL_SNAPSHOT_PATH):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.file = None
+        self.ops = 0
+        self.generation = 0
+
+    @staticmethod
+    def pack(track: Track) -> list:
+        return [track.url, track.title, track.duration]
+
+    @staticmethod
+    def unpack(entry: list) -> Track:
+        url, title, duration = entry
+        return Track(url=url, source_url="", title=title, thumbnail=None, duration=duration)
+
+    @staticmethod
+    def empty_guild() -> dict:
+        return {"queue": [], "voice": None, "text": None, "pos": 0.0}
+
+    def load(self) -> Dict[int, dict]:
+        """Rebuild {guild_id: {"queue", "voice", "text", "pos"}} from snapshot + log."""
+        guilds: Dict[int, dict] = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                try:
+                    data = json.load(f)
+                    if "guilds" not in data:
+                        data = {"gen": 0, "guilds": data}  # written before generations existed
+                    self.generation = data["gen"]
+                    guilds = {int(k): v for k, v in data["guilds"].items()}
+                except ValueError:
+                    print("[Music] Queue snapshot is corrupt; ignoring it")
+
+        if os.path.exists(self.path):
+            valid = 0
+            log_generation = 0
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn write at the tail
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    valid += len(line)
+                    if entry[0] == "gen":
+                        log_generation = entry[1]
+                        continue
+                    if log_generation < self.generation:
+                        # Already folded into the snapshot by a compaction that crashed
+                        continue
+                    self.apply(guilds, entry)
+                    self.ops += 1
+            if log_generation < self.generation:
+                valid = 0  # stale log: start a fresh one for this generation
+            # Cut off the torn tail so new entries don't get glued onto it
+            if valid < os.path.getsize(self.path):
+                os.truncate(self.path, valid)
+        return guilds
+
+    def apply(self, guilds: Dict[int, dict], entry: list):
+        op, guild_id, *args = entry
+        g = guilds.setdefault(guild_id, self.empty_guild())
+        queue = g["queue"]
+        if op == "append":
+            queue.append(args[0])
+        elif op == "insert":
+            queue.insert(args[0], args[1])
+        elif op == "pop":
+            if 0 <= args[0] < len(queue):
+                queue.pop(args[0])
+                if args[0] == 0:
+                    g["pos"] = 0.0
+        elif op == "set":
+            g["queue"] = args[0]
+        elif op == "clear":
+            queue.clear()
+            g["pos"] = 0.0
+        elif op == "channels":
+            g["voice"], g["text"] = args
+        elif op == "pos":
+            g["pos"] = args[0]
+
+    def open(self):
+        self.file = open(self.path, "a", encoding="utf-8")
+        if self.file.tell() == 0:
+            self.write_header()
+
+    def write_header(self):
+        self.file.write(json.dumps(["gen", self.generation]) + "\n")
+        self.file.flush()
+
+    def write(self, op: str, guild_id: int, *args):
+        if self.file is None:
+            return
+        args = [self.pack(a) if isinstance(a, Track) else a for a in args]
+        if op == "set":
+            args = [[self.pack(t) for t in args[0]]]
+        self.file.write(json.dumps([op, guild_id, *args], separators=(",", ":")) + "\n")
+        # Flushed per line so a crashed process loses nothing the OS has seen
+        self.file.flush()
+        self.ops += 1
+
+    def compact(self, guilds: Dict[int, dict]):
+        generation = self.generation + 1
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"gen": generation, "guilds": guilds}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.generation = generation
+
+        if self.file:
+            self.file.close()
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.write_header()
+        self.ops = 0
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# ------------------------
+# SEARCH CACHE / TITLE INDEX
+# ------------------------
+
+class SearchCache:
+    """TTL + LRU cache of /search result lists keyed by normalised query."""
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, list]]" = OrderedDict()
+
+    @staticmethod
+    def normalise(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, query: str) -> Optional[list]:
+        key = self.normalise(query)
+        hit = self.entries.get(key)
+        if hit is None:
+            return None
+        expires, results = hit
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return results
+
+    def put(self, query: str, results: list):
+        key = self.normalise(query)
+        self.entries[key] = (time.monotonic() + self.ttl, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class TitleIndex:
+    """In-memory trigram index of titles played in one guild, for autocomplete.
+
+    Lookups only touch the posting lists of the query's trigrams, so answers
+    come back in well under Discord's 3-second autocomplete window without
+    ever calling yt-dlp. Ties are broken by how often a title was played.
+    """
+
+    def __init__(self):
+        self.titles: Dict[str, str] = {}         # url -> title
+        self.plays: Dict[str, int] = {}          # url -> play count
+        self.postings: Dict[str, Set[str]] = {}  # trigram -> urls
+
+    @staticmethod
+    def trigrams(text: str) -> Set[str]:
+        text = f"  {SearchCache.normalise(text)} "
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, url: str, title: str):
+        self.plays[url] = self.plays.get(url, 0) + 1
+        if self.titles.get(url) == title:
+            return
+        old = self.titles.get(url)
+        if old is not None:
+            for gram in self.trigrams(old):
+                self.postings.get(gram, set()).discard(url)
+        self.titles[url] = title
+        for gram in self.trigrams(title):
+            self.postings.setdefault(gram, set()).add(url)
+
+    def search(self, query: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Tuple[str, str]]:
+        """Best (url, title) matches for a partial query, most played first when empty."""
+        if not query.strip():
+            ranked = sorted(self.plays, key=self.plays.get, reverse=True)
+            return [(url, self.titles[url]) for url in ranked[:limit]]
+
+        scores: Dict[str, int] = {}
+        for gram in self.trigrams(query):
+            for url in self.postings.get(gram, ()):
+                scores[url] = scores.get(url, 0) + 1
+        ranked = sorted(scores, key=lambda url: (scores[url], self.plays[url]), reverse=True)
+        return [(url, self.titles[url]) for url in ranked[:limit]]
+
+
+# ------------------------
+# CACHE DATABASE
+# ------------------------
+
+class CacheStore:
+    """Base for the SQLite-backed caches sharing TRACK_CACHE_DB.
+
+    The database runs in WAL mode with synchronous=NORMAL, so reads on the
+    event loop never wait for an fsync. Writes are queued with write() and
+    committed together by flush() in a worker thread; unsaved() lets a
+    subclass see writes that haven't reached the database yet.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()    # the connection is shared with the flush thread
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.writes: List[Tuple[str, tuple]] = []
+        self.inflight: List[Tuple[str, tuple]] = []
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def write(self, sql: str, params: tuple):
+        self.writes.append((sql, params))
+
+    def unsaved(self) -> List[Tuple[str, tuple]]:
+        return self.inflight + self.writes
+
+    def _commit(self, batch: List[Tuple[str, tuple]]):
+        with self.lock:
+            with self.db:
+                for sql, params in batch:
+                    self.db.execute(sql, params)
+            # Committed: close() must not write this batch again
+            if batch is self.inflight:
+                self.inflight = []
+
+    async def flush(self):
+        if not self.writes or self.inflight:
+            return
+        batch = self.inflight = self.writes
+        self.writes = []
+        try:
+            await asyncio.to_thread(self._commit, batch)
+        except Exception as e:
+            print(f"[Music] Failed to save {type(self).__name__}, will retry: {e}")
+            self.writes = batch + self.writes
+        self.inflight = []
+
+    def close(self):
+        # Taking the lock waits out a flush thread mid-commit
+        with self.lock:
+            batch, self.writes = self.inflight + self.writes, []
+            self.inflight = []
+            with self.db:
+                for sql, params in batch:
+                    self.db.execute(sql, params)
+            self.db.close()
+
+
+# ------------------------
+# TRACK CACHE
+# ------------------------
+
+class TrackCache(CacheStore):
+    """Two-tier cache of resolved tracks keyed by YouTube video ID.
+
+    Title, thumbnail and duration are kept forever; the stream URL is only
+    served while it is fresh according to the signed URL's own expiry.
+    The memory tier is an LRU bounded to `max_entries`; the SQLite tier
+    survives restarts.
+    """
+
+    def __init__(self, path: str = TRACK_CACHE_DB, max_entries: int = TRACK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, Track]" = OrderedDict()
+        self.hits = 0       # fresh stream URL served, yt-dlp skipped
+        self.misses = 0     # had to go to yt-dlp
+
+        super().__init__(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            " video_id TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " thumbnail TEXT,"
+            " duration INTEGER,"
+            " source_url TEXT NOT NULL DEFAULT '',"
+            " expires_at REAL)"
+        )
+        # Columns added after the first release of the cache
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(tracks)")}
+        for name, kind in (("acodec", "TEXT"), ("asr", "INTEGER"), ("loudness", "REAL")):
+            if name not in columns:
+                self.db.execute(f"ALTER TABLE tracks ADD COLUMN {name} {kind}")
+        self.db.commit()
+
+    def _remember(self, video_id: str, track: Track):
+        self.memory[video_id] = track
+        self.memory.move_to_end(video_id)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _load(self, video_id: str) -> Optional[Track]:
+        track = self.memory.get(video_id)
+        if track is not None:
+            self.memory.move_to_end(video_id)
+            return track
+
+        rows = self.query(
+            "SELECT url, source_url, title, thumbnail, duration, expires_at, acodec, asr, loudness"
+            " FROM tracks WHERE video_id = ?",
+            (video_id,),
+        )
+        if not rows:
+            return None
+        track = Track(*rows[0])
+        self._remember(video_id, track)
+        return track
+
+    def get(self, video_id: str, play_at: Optional[float] = None) -> Optional[Track]:
+        """Cached track whose stream URL is still valid at `play_at`, counting hits/misses."""
+        track = self._load(video_id)
+        if track is not None and track.is_fresh(play_at):
+            self.hits += 1
+            return replace(track)
+        self.misses += 1
+        return None
+
+    def get_metadata(self, video_id: str) -> Optional[Track]:
+        """Cached track regardless of stream URL freshness (for titles/durations)."""
+        track = self._load(video_id)
+        return replace(track) if track is not None else None
+
+    def put(self, video_id: str, track: Track) -> Track:
+        track = replace(track)
+        if track.loudness is None:
+            # A fresh extraction doesn't know the measured loudness; keep it
+            old = self._load(video_id)
+            if old is not None:
+                track.loudness = old.loudness
+        self._remember(video_id, track)
+        # The memory tier serves it until the write is flushed
+        self.write(
+            "INSERT OR REPLACE INTO tracks"
+            " (video_id, url, title, thumbnail, duration, source_url, expires_at, acodec, asr, loudness)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (video_id, track.url, track.title, track.thumbnail, track.duration,
+             track.source_url, track.expires_at, track.acodec, track.asr, track.loudness),
+        )
+        return replace(track)
+
+    def set_loudness(self, video_id: str, loudness: float):
+        track = self.memory.get(video_id)
+        if track is not None:
+            track.loudness = loudness
+        self.write("UPDATE tracks SET loudness = ? WHERE video_id = ?", (loudness, video_id))
+
+    def stats(self) -> Dict[str, int]:
+        disk = self.query("SELECT COUNT(*) FROM tracks")[0][0]
+        return {"hits": self.hits, "misses": self.misses, "memory": len(self.memory), "disk": disk}
+
+
+# ------------------------
+# SPOTIFY -> YOUTUBE INDEX
+# ------------------------
+
+def match_confidence(sp_track: dict, entry: dict) -> float:
+    """0..1 score of how well a YouTube search result matches a Spotify track."""
+    wanted = f"{sp_track['name']} {sp_track['artists'][0]['name']}".lower()
+    got = (entry.get("title") or "").lower()
+    title_score = SequenceMatcher(None, wanted, got).ratio()
+
+    sp_seconds = (sp_track.get("duration_ms") or 0) / 1000
+    yt_seconds = entry.get("duration")
+    if sp_seconds and yt_seconds:
+        duration_score = max(0.0, 1 - abs(sp_seconds - yt_seconds) / 30)
+    else:
+        duration_score = 0.5
+    return round(0.7 * title_score + 0.3 * duration_score, 3)
+
+
+class SpotifyIndex(CacheStore):
+    """Persistent map of Spotify track ID / ISRC to the chosen YouTube video ID."""
+
+    STORE = "INSERT OR REPLACE INTO spotify_map VALUES (?, ?, ?, ?, ?)"
+
+    def __init__(self, path: str = TRACK_CACHE_DB):
+        self.hits = 0
+        self.misses = 0
+
+        super().__init__(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS spotify_map ("
+            " spotify_id TEXT PRIMARY KEY,"
+            " isrc TEXT,"
+            " video_id TEXT NOT NULL,"
+            " confidence REAL NOT NULL,"
+            " mapped_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS spotify_map_isrc ON spotify_map (isrc)")
+        self.db.commit()
+
+    @staticmethod
+    def isrc_of(sp_track: dict) -> Optional[str]:
+        # Simplified track objects (album listings) carry no external IDs
+        return (sp_track.get("external_ids") or {}).get("isrc")
+
+    def lookup(self, sp_track: dict) -> Optional[str]:
+        """YouTube video ID previously chosen for this track (by ID, then by ISRC)."""
+        rows = []
+        isrc = self.isrc_of(sp_track)
+        # Mappings stored moments ago (e.g. earlier in the same import) may not be flushed yet
+        for sql, params in reversed(self.unsaved()):
+            if sql is self.STORE and (params[0] == sp_track.get("id") or (isrc and params[1] == isrc)):
+                rows = [(params[2],)]
+                break
+        if not rows and sp_track.get("id"):
+            rows = self.query("SELECT video_id FROM spotify_map WHERE spotify_id = ?", (sp_track["id"],))
+        if not rows and isrc:
+            rows = self.query(
+                "SELECT video_id FROM spotify_map WHERE isrc = ? ORDER BY confidence DESC LIMIT 1", (isrc,)
+            )
+
+        if not rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rows[0][0]
+
+    def store(self, sp_track: dict, video_id: str, confidence: float):
+        if not sp_track.get("id"):
+            return
+        self.write(self.STORE, (sp_track["id"], self.isrc_of(sp_track), video_id, confidence, time.time()))
+
+    def stats(self) -> Dict[str, int]:
+        size = self.query("SELECT COUNT(*) FROM spotify_map")[0][0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+# ------------------------
+# AUDIO CACHE
+# ------------------------
+
+class AudioCache(CacheStore):
+    """Size-bounded directory of Opus files for tracks played at least `min_plays` times.
+
+    Play counts and file sizes live in SQLite next to the track cache.
+    Files are written by ffmpeg in the background and evicted least
+    recently played first once the byte budget is exceeded.
+    """
+
+    RECORD_PLAY = (
+        "INSERT INTO audio_files (video_id, plays, last_played) VALUES (?, 1, ?)"
+        " ON CONFLICT(video_id) DO UPDATE SET plays = plays + 1, last_played = excluded.last_played"
+    )
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, budget: int = AUDIO_CACHE_BUDGET,
+                 min_plays: int = AUDIO_CACHE_MIN_PLAYS, db_path: str = TRACK_CACHE_DB):
+        self.directory = directory
+        self.budget = budget
+        self.min_plays = min_plays
+        self.hits = 0
+        self.misses = 0
+        self.downloading: Set[str] = set()
+        self.download_slots = asyncio.Semaphore(AUDIO_CACHE_DOWNLOADS)
+        os.makedirs(directory, exist_ok=True)
+
+        super().__init__(db_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS audio_files ("
+            " video_id TEXT PRIMARY KEY,"
+            " plays INTEGER NOT NULL DEFAULT 0,"
+            " last_played REAL NOT NULL DEFAULT 0,"
+            " size INTEGER NOT NULL DEFAULT 0,"
+            " cached INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.commit()
+
+    def path_for(self, video_id: str) -> str:
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    def lookup(self, video_id: str) -> Optional[str]:
+        """Local file for this video, if it is cached and still on disk."""
+        rows = self.query("SELECT cached FROM audio_files WHERE video_id = ?", (video_id,))
+        if not rows or not rows[0][0]:
+            return None
+        path = self.path_for(video_id)
+        if not os.path.exists(path):
+            self.write("UPDATE audio_files SET cached = 0, size = 0 WHERE video_id = ?", (video_id,))
+            return None
+        return path
+
+    def record_play(self, video_id: str) -> bool:
+        """Count a play; True if the track should now be downloaded."""
+        self.write(self.RECORD_PLAY, (video_id, time.time()))
+
+        if self.lookup(video_id):
+            self.hits += 1
+            return False
+        self.misses += 1
+        rows = self.query("SELECT plays FROM audio_files WHERE video_id = ?", (video_id,))
+        plays = (rows[0][0] if rows else 0) + sum(
+            1 for sql, params in self.unsaved() if sql is self.RECORD_PLAY and params[0] == video_id
+        )
+        return plays >= self.min_plays and video_id not in self.downloading
+
+    async def download(self, video_id: str, track: Track):
+        """Store the track as an Opus file (remuxed if already Opus) and enforce the budget."""
+        if video_id in self.downloading:
+            return
+        self.downloading.add(video_id)
+        path = self.path_for(video_id)
+        tmp_path = path + ".part"
+        codec = ["-c:a", "copy"] if track.is_opus_48k else ["-c:a", "libopus", "-b:a", "128k", "-ar", "48000"]
+        try:
+            async with self.download_slots:
+                proc = await asyncio.create_subprocess_exec(
+                    FFMPEG_EXECUTABLE, "-y", "-loglevel", "error",
+                    *FFMPEG_OPTIONS["before_options"].split(),
+                    "-i", track.source_url, "-vn", *codec, "-f", "ogg", tmp_path,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                if await proc.wait() != 0:
+                    raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+
+            os.replace(tmp_path, path)
+            await asyncio.to_thread(self.store_file, video_id, os.path.getsize(path))
+        except Exception as e:
+            print(f"[Music] Audio cache download failed for {video_id}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            self.downloading.discard(video_id)
+
+    def store_file(self, video_id: str, size: int):
+        """Mark a finished download as cached, then evict down to the budget (worker thread)."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE audio_files SET cached = 1, size = ? WHERE video_id = ?", (size, video_id))
+            while True:
+                occupancy = self.db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM audio_files WHERE cached = 1"
+                ).fetchone()[0]
+                if occupancy <= self.budget:
+                    return
+                row = self.db.execute(
+                    "SELECT video_id FROM audio_files WHERE cached = 1 ORDER BY last_played ASC LIMIT 1"
+                ).fetchone()
+                if not row:
+                    return
+                try:
+                    os.remove(self.path_for(row[0]))
+                except FileNotFoundError:
+                    pass
+                self.db.execute("UPDATE audio_files SET cached = 0, size = 0 WHERE video_id = ?", (row[0],))
+
+    def occupancy(self) -> int:
+        return self.query("SELECT COALESCE(SUM(size), 0) FROM audio_files WHERE cached = 1")[0][0]
+
+    def stats(self) -> Dict[str, int]:
+        files = self.query("SELECT COUNT(*) FROM audio_files WHERE cached = 1")[0][0]
+        return {"hits": self.hits, "misses": self.misses, "files": files, "bytes": self.occupancy()}
 
 
 # ------------------------
@@ -86,21 +1927,84 @@ class Music(commands.Cog):
         # Per-guild state
         self.states: Dict[int, GuildMusicState] = {}
 
-        # Idle disconnect loop
-        self.idle_checker.start()
+        # Queue journal: restore saved queues now, resume playback once ready
+        self.journal = QueueJournal()
+        self.pending_resume = self.restore_states(self.journal.load())
+        self.journal.open()
+        self.journal_checkpoint.start()
+
+        metrics.add_collector(self.collect_metrics)
+
+        # yt-dlp extraction service
+        self.resolver = TrackResolver()
+
+        # Resolved track cache
+        self.track_cache = TrackCache()
+
+        # Spotify track -> YouTube video mapping
+        self.spotify_index = SpotifyIndex()
+
+        # Now-playing progress bars for every guild
+        self.progress = ProgressScheduler(self)
+
+        # Local copies of frequently played tracks
+        self.audio_cache = AudioCache() if AUDIO_CACHE_ENABLED else None
+
+        # Optional worker processes for ffmpeg + Opus encoding
+        self.voice_pool = VoicePool(VOICE_WORKERS) if VOICE_WORKERS > 0 else None
+
+        # /search results and per-guild autocomplete titles
+        self.search_cache = SearchCache()
+        self.title_indexes: Dict[int, TitleIndex] = {}
+
+        # Loudness measurements in flight (one ffmpeg analysis at a time)
+        self.measuring: Set[str] = set()
+        self.measure_slots = asyncio.Semaphore(1)
+
+        # Idle disconnect deadlines
+        self.idle = IdleTimers(self.on_idle_timeout)
+
+        # Batched commits for the cache databases
+        self.flush_caches.start()
 
     def cog_unload(self):
-        self.idle_checker.cancel()
+        metrics.remove_collector(self.collect_metrics)
+        for state in self.states.values():
+            if state.player_task:
+                state.player_task.cancel()
+        self.journal_checkpoint.cancel()
+        self.journal.compact(self.journal_snapshot())
+        self.journal.close()
+        self.idle.stop()
+        self.progress.stop()
+        if self.voice_pool:
+            self.voice_pool.stop()
+        self.resolver.shutdown()
+        self.flush_caches.cancel()
+        self.track_cache.close()
+        self.spotify_index.close()
+        if self.audio_cache:
+            self.audio_cache.close()
 
     # ------------
     # State helper
     # ------------
 
+    def collect_metrics(self):
+        metrics.QUEUE_DEPTH.clear()
+        for guild_id, state in self.states.items():
+            metrics.QUEUE_DEPTH.set(len(state.queue), str(guild_id))
+
     def get_state(self, guild: discord.Guild) -> GuildMusicState:
         state = self.states.get(guild.id)
         if state is None:
-            state = GuildMusicState()
-            self.states[guild.id] = state
+            state = self.new_state(guild.id)
+        return state
+
+    def new_state(self, guild_id: int) -> GuildMusicState:
+        state = GuildMusicState()
+        state.queue.listener = lambda op, *args: self.journal.write(op, guild_id, *args)
+        self.states[guild_id] = state
         return state
 
     # ------------
@@ -116,14 +2020,16 @@ class Music(commands.Cog):
             return f"{h}:{m:02}:{s:02}"
         return f"{m}:{s:02}"
 
-    async def search_youtube(self, query: str) -> Optional[str]:
-        ydl_opts = {"format": "bestaudio", "noplaylist": True, "quiet": True}
-        with YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(f"ytsearch:{query}", download=False)["entries"][0]
-                return info["webpage_url"]
-            except Exception:
-                return None
+    async def search_youtube_entry(self, guild_id: int, query: str) -> Optional[dict]:
+        try:
+            info = await self.resolver.extract(guild_id, f"ytsearch:{query}", "search")
+            return info["entries"][0]
+        except Exception:
+            return None
+
+    async def search_youtube(self, guild_id: int, query: str) -> Optional[str]:
+        entry = await self.search_youtube_entry(guild_id, query)
+        return entry["webpage_url"] if entry else None
 
     def build_track_from_info(self, info: dict, url: str) -> Track:
         return Track(
@@ -132,8 +2038,273 @@ class Music(commands.Cog):
             title=info.get("title", "Unknown"),
             thumbnail=info.get("thumbnail"),
             duration=info.get("duration"),
+            expires_at=stream_expiry(info["url"]),
+            acodec=info.get("acodec"),
+            asr=info.get("asr"),
         )
 
+    async def resolve_track(self, guild_id: int, state: GuildMusicState, track: Track,
+                            play_at: Optional[float] = None) -> Track:
+        """Fill in a queued track's stream URL and metadata, unless still fresh at `play_at`."""
+        if track.is_fresh(play_at):
+            return track
+
+        video_id = youtube_video_id(track.url)
+        if video_id:
+            cached = self.track_cache.get(video_id, play_at)
+            if cached:
+                copy_resolved(track, cached)
+                return track
+
+        # Share one extraction between the look-ahead and the player
+        key = id(track)
+        task = state.resolving.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.resolver.extract(guild_id, track.url, "play", purpose="playback"))
+            state.resolving[key] = task
+            task.add_done_callback(lambda _: state.resolving.pop(key, None))
+
+        info = await asyncio.shield(task)
+        resolved = self.build_track_from_info(info, track.url)
+        if video_id:
+            resolved = self.track_cache.put(video_id, resolved)
+        copy_resolved(track, resolved)
+        return track
+
+    def schedule_lookahead(self, guild: discord.Guild):
+        """(Re)start background resolution of the tracks after queue[0]."""
+        state = self.get_state(guild)
+        if state.lookahead_task and not state.lookahead_task.done():
+            return
+        if len(state.queue) < 2 or state.lookahead_depth <= 0:
+            return
+        state.lookahead_task = asyncio.create_task(self.lookahead(guild.id, state))
+
+    async def lookahead(self, guild_id: int, state: GuildMusicState):
+        # Estimate when each upcoming track will start so its URL is still valid then
+        play_at = time.time()
+        current = state.current
+        if current and current.duration and state.started_at:
+            play_at = max(play_at, state.started_at + current.duration)
+
+        for track in state.queue[1:1 + state.lookahead_depth]:
+            try:
+                await self.resolve_track(guild_id, state, track, play_at)
+            except ResolveCancelled:
+                return
+            except Exception as e:
+                # Leave it unresolved; play_next_track will retry and report
+                print(f"[Music] Look-ahead failed for {track.url}: {e}")
+                continue
+            play_at += track.duration or 0
+
+    def make_queued_track(self, url: str, title: Optional[str] = None,
+                          duration: Optional[int] = None) -> Track:
+        """Unresolved queue entry; stream URL is filled in when (or before) it plays."""
+        track = Track(url=url, source_url="", title=title or url, thumbnail=None, duration=duration)
+        video_id = youtube_video_id(url)
+        cached = self.track_cache.get_metadata(video_id) if video_id else None
+        if cached:
+            track.title, track.thumbnail, track.duration = cached.title, cached.thumbnail, cached.duration
+        return track
+
+    # ------------------------
+    # YOUTUBE PLAYLISTS
+    # ------------------------
+
+    async def import_youtube_playlist(self, interaction: discord.Interaction, url: str):
+        """Queue a YouTube playlist or mix page by page from a flat listing.
+
+        Only titles and IDs are listed here; each video's stream is resolved
+        by the player/look-ahead shortly before it plays, so playback starts
+        after the first page.
+        """
+        guild = interaction.guild
+        state = self.get_state(guild)
+        voice_channel_id = state.voice_channel_id
+
+        progress_msg = await interaction.followup.send("📃 Reading playlist…", wait=True)
+        title = "playlist"
+        added = 0
+        last_edit = time.monotonic()
+
+        pages = self.resolver.extract_pages(guild.id, url, PLAYLIST_PAGE_SIZE)
+        try:
+            async for info, page in pages:
+                # Stop if the bot was told to /leave mid-import
+                if state.voice_channel_id != voice_channel_id:
+                    break
+                title = info.get("title") or title
+                for entry in page[:PLAYLIST_MAX_ENTRIES - added]:
+                    video_id = entry.get("id")
+                    entry_url = f"https://www.youtube.com/watch?v={video_id}" if video_id else entry.get("url")
+                    if not entry_url:
+                        continue
+                    duration = entry.get("duration")
+                    state.queue.append(self.make_queued_track(
+                        entry_url, entry.get("title"), int(duration) if duration else None,
+                    ))
+                    added += 1
+
+                # Start playing as soon as the first page is in; the rest keeps listing
+                await self.start_playback_if_needed(guild)
+                self.schedule_lookahead(guild)
+
+                if added >= PLAYLIST_MAX_ENTRIES:
+                    break
+                if time.monotonic() - last_edit >= SPOTIFY_PROGRESS_INTERVAL:
+                    last_edit = time.monotonic()
+                    try:
+                        await progress_msg.edit(content=f"📃 Reading **{title}**: {added} added so far…")
+                    except Exception:
+                        pass
+        except Exception as e:
+            if not added:
+                return await progress_msg.edit(content=f"Failed to read playlist: {e or type(e).__name__}")
+            print(f"[Music] Playlist import for guild {guild.id} stopped early: {e}")
+        finally:
+            await pages.aclose()
+
+        if not added:
+            return await progress_msg.edit(content="No playable videos found in that playlist.")
+
+        await progress_msg.edit(content=f"✅ Added {added} song(s) from **{title}** to the queue.")
+        await self.start_playback_if_needed(guild)
+
+    # ------------------------
+    # SPOTIFY
+    # ------------------------
+
+    async def spotify_call(self, func, *args, **kwargs):
+        # spotipy is synchronous; keep its HTTP round trips off the event loop
+        with metrics.SPOTIFY_API.time(func.__name__):
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def map_spotify_track(self, guild_id: int, sp_track: dict) -> Optional[str]:
+        """YouTube URL for a Spotify track, from the index or a fresh search."""
+        video_id = self.spotify_index.lookup(sp_track)
+        if video_id:
+            return f"https://www.youtube.com/watch?v={video_id}"
+
+        query = f"{sp_track['name']} {sp_track['artists'][0]['name']}"
+        entry = await self.search_youtube_entry(guild_id, query)
+        if not entry:
+            return None
+
+        url = entry["webpage_url"]
+        video_id = entry.get("id") or youtube_video_id(url)
+        if video_id:
+            self.spotify_index.store(sp_track, video_id, match_confidence(sp_track, entry))
+        return url
+
+    async def spotify_collection(self, kind: str, url: str) -> AsyncIterator[dict]:
+        """Yield every track object of a playlist, album or artist, following `next` pages."""
+        if kind == "artist":
+            results = await self.spotify_call(self.sp.artist_top_tracks, url)
+            for t in results["tracks"]:
+                yield t
+            return
+
+        if kind == "playlist":
+            page = await self.spotify_call(self.sp.playlist_items, url, additional_types=("track",))
+        else:
+            page = await self.spotify_call(self.sp.album_tracks, url)
+
+        while page:
+            for item in page["items"]:
+                # Playlist items wrap the track; album items are the track
+                t = item.get("track") if kind == "playlist" else item
+                if t and t.get("name"):
+                    yield t
+            page = await self.spotify_call(self.sp.next, page) if page.get("next") else None
+
+    async def import_spotify_collection(self, interaction: discord.Interaction, kind: str, url: str):
+        """Map a Spotify collection to YouTube and queue tracks as they resolve.
+
+        Searches run with bounded concurrency; results are appended in
+        collection order as soon as every earlier entry has been resolved,
+        so playback starts right after the first hit.
+        """
+        guild = interaction.guild
+        state = self.get_state(guild)
+        voice_channel_id = state.voice_channel_id
+
+        progress_msg = await interaction.followup.send(f"🔎 Importing Spotify {kind}…", wait=True)
+
+        sem = asyncio.Semaphore(SPOTIFY_IMPORT_CONCURRENCY)
+        results: Dict[int, Optional[Track]] = {}
+        tasks: Set[asyncio.Task] = set()
+        counts = {"seen": 0, "added": 0, "failed": 0, "next": 0}
+        last_edit = 0.0
+
+        def flush():
+            # Append the contiguous resolved prefix, preserving collection order
+            started = False
+            while counts["next"] in results:
+                track = results.pop(counts["next"])
+                counts["next"] += 1
+                if track is None:
+                    counts["failed"] += 1
+                    continue
+                state.queue.append(track)
+                counts["added"] += 1
+                started = started or counts["added"] == 1
+            if started:
+                asyncio.create_task(self.start_playback_if_needed(guild))
+            if counts["added"]:
+                self.schedule_lookahead(guild)
+
+        async def map_one(index: int, t: dict):
+            try:
+                yt_url = await self.map_spotify_track(guild.id, t)
+            except Exception:
+                yt_url = None
+            finally:
+                sem.release()
+            results[index] = self.make_queued_track(yt_url) if yt_url else None
+            flush()
+
+        async def report(done: bool = False):
+            nonlocal last_edit
+            now = time.monotonic()
+            if not done and now - last_edit < SPOTIFY_PROGRESS_INTERVAL:
+                return
+            last_edit = now
+            status = "✅ Imported" if done else "🔎 Importing"
+            text = f"{status} Spotify {kind}: {counts['added']} added"
+            if counts["failed"]:
+                text += f", {counts['failed']} not found"
+            if not done:
+                text += f" ({counts['seen']} read so far)"
+            try:
+                await progress_msg.edit(content=text)
+            except Exception:
+                pass
+
+        try:
+            async for t in self.spotify_collection(kind, url):
+                # Stop if the bot was told to /leave mid-import
+                if state.voice_channel_id != voice_channel_id:
+                    break
+                await sem.acquire()
+                task = asyncio.create_task(map_one(counts["seen"], t))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                counts["seen"] += 1
+                await report()
+
+            while tasks:
+                await asyncio.wait(set(tasks), timeout=SPOTIFY_PROGRESS_INTERVAL)
+                await report()
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            return await progress_msg.edit(content=f"Failed to process Spotify URL: {e}")
+
+        if not counts["added"]:
+            return await progress_msg.edit(content="No valid songs could be added.")
+        await report(done=True)
+
     # ------------------------
     # CORE PLAYBACK
     # ------------------------
@@ -170,151 +2341,230 @@ class Music(commands.Cog):
             return None
 
     async def start_playback_if_needed(self, guild: discord.Guild):
-        """Start playback if nothing is currently playing."""
+        """Ask the player to start if nothing is currently playing."""
         state = self.get_state(guild)
-        vc = guild.voice_client
+        self.post_event(guild.id, state, "play", 0.0)
+
+    def make_source(self, track: Track, volume: float, start_at: float = 0.0,
+                    guild_id: int = 0) -> TrackedSource:
+        """Build the ffmpeg source chain for a resolved track (see build_source).
+
+        With voice workers enabled the chain runs in the guild's worker process
+        and only finished Opus packets come back here.
+        """
+        source_url = track.source_url
+        before_options = FFMPEG_OPTIONS["before_options"]
+
+        # Prefer a local copy (always Opus/48 kHz; no reconnect options for files)
+        video_id = youtube_video_id(track.url) if self.audio_cache else None
+        local_path = self.audio_cache.lookup(video_id) if video_id else None
+        if local_path:
+            source_url = local_path
+            before_options = ""
+
+        params = {
+            "source_url": source_url,
+            "opus_48k": bool(local_path) or track.is_opus_48k,
+            "volume": volume,
+            "start_at": start_at,
+            "before_options": before_options,
+            "gain": loudness_gain(track.loudness),
+        }
+        if self.voice_pool:
+            return TrackedSource(self.voice_pool.open(guild_id, params), offset=start_at)
+        return build_source(**params)
+
+    async def measure_loudness(self, video_id: str, track: Track):
+        """Measure a track's integrated loudness once with ffmpeg and cache it."""
+        if video_id in self.measuring:
+            return
+        self.measuring.add(video_id)
+        local_path = self.audio_cache.lookup(video_id) if self.audio_cache else None
+        source_url = local_path or track.source_url
+        before = [] if local_path else FFMPEG_OPTIONS["before_options"].split()
+        try:
+            async with self.measure_slots:
+                proc = await asyncio.create_subprocess_exec(
+                    FFMPEG_EXECUTABLE, "-hide_banner", "-nostats", *before,
+                    "-i", source_url, "-vn", "-af", "ebur128=framelog=verbose", "-f", "null", "-",
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await proc.communicate()
+
+            matches = re.findall(r"I:\s+(-?[\d.]+) LUFS", stderr.decode(errors="replace"))
+            if proc.returncode != 0 or not matches:
+                raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+            loudness = float(matches[-1])
+        except Exception as e:
+            print(f"[Music] Loudness measurement failed for {video_id}: {e}")
+            return
+        finally:
+            self.measuring.discard(video_id)
+
+        self.track_cache.set_loudness(video_id, loudness)
+        track.loudness = loudness
+
+        # Apply to the live source if this track is still playing on the PCM path
+        for guild_id, state in self.states.items():
+            if state.current and youtube_video_id(state.current.url) == video_id:
+                state.current.loudness = loudness
+                guild = self.bot.get_guild(guild_id)
+                vc = guild.voice_client if guild else None
+                source = vc.source if vc else None
+                if isinstance(source, TrackedSource) and isinstance(source.inner, NormalizedPCMSource):
+                    source.inner.gain = loudness_gain(loudness)
+                elif isinstance(source, TrackedSource) and isinstance(source.inner, RemoteOpusSource):
+                    source.inner.set("gain", loudness_gain(loudness))
+
+    # ------------------------
+    # PLAYER
+    # ------------------------
+
+    def post_event(self, guild_id: int, state: GuildMusicState, event: str, arg=None,
+                   posted: Optional[float] = None):
+        """Queue an event for the guild's player task, starting the task if needed.
+
+        Events: ("play", start_at), ("ended", track), ("skip", track).
+        """
+        if state.player_task is None or state.player_task.done():
+            state.player_task = asyncio.create_task(self.player_loop(guild_id, state))
+        state.events.put_nowait((event, arg, posted or time.perf_counter()))
+
+    async def player_loop(self, guild_id: int, state: GuildMusicState):
+        """The only place tracks are finished and started, one event at a time."""
+        while True:
+            event, arg, posted = await state.events.get()
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                continue
+
+            start_at = 0.0
+            vc = guild.voice_client
+            if event == "skip" and state.current is arg and vc and (vc.is_playing() or vc.is_paused()):
+                # The skipped track started while the skip was queued (/skip came in
+                # during ensure_voice/start_track): stop it and let its "ended" move on
+                self.progress.cancel(guild_id)
+                vc.stop()
+                continue
+            if event in ("ended", "skip"):
+                # `arg` is the queue entry that stopped; /leave or /remove may
+                # already have dropped it, and a stale event must not pop the next one
+                if state.queue and state.queue[0] is arg:
+                    state.queue.popleft()
+                if state.current is arg:
+                    state.current = None
+            else:
+                start_at = arg or 0.0
 
-        if state.current is None and state.queue:
-            await self.play_next_track(guild)
-        elif not vc or not vc.is_playing():
-            # In case voice client died mid-track
-            await self.play_next_track(guild)
+            try:
+                await self.play_next_track(guild, start_at, posted)
+            except Exception as e:
+                print(f"[Music] Player error in guild {guild_id}: {e}")
 
-    async def play_next_track(self, guild: discord.Guild):
-        """Pop next track from queue and play it."""
+    async def play_next_track(self, guild: discord.Guild, start_at: float = 0.0,
+                              posted: Optional[float] = None):
+        """Play queue[0] (from `start_at` seconds in), skipping tracks that fail to resolve."""
         state = self.get_state(guild)
 
-        if not state.queue:
-            state.current = None
-            state.idle_time = 0
-            # Optionally clear now playing message
+        vc = guild.voice_client
+        if vc and (vc.is_playing() or vc.is_paused()):
+            # Duplicate "play" or a stale event: something is already on
             return
 
-        # Get next URL and resolve audio stream with yt-dlp
-        next_url = state.queue[0].url
-
-        with YoutubeDL(YDL_OPTIONS) as ydl:
+        while state.queue:
+            # Resolve audio stream with yt-dlp (usually already done by the look-ahead)
+            queued = state.queue[0]
             try:
-                info = ydl.extract_info(next_url, download=False)
+                track = await self.resolve_queued(guild.id, state, queued)
+            except ResolveCancelled:
+                # /skip or /leave already dealt with the queue
+                return
             except Exception as e:
                 if state.text_channel:
-                    await state.text_channel.send(f"Failed to fetch audio: {e}")
-                # Drop this track and try next
-                state.queue.pop(0)
-                return await self.play_next_track(guild)
+                    await state.text_channel.send(f"Failed to fetch audio: {e or type(e).__name__}")
+                # Drop this track and try the next one
+                if state.queue and state.queue[0] is queued:
+                    state.queue.popleft()
+                start_at = 0.0
+                continue
+
+            await self.start_track(guild, state, track, start_at, posted)
+            return
 
-        track = self.build_track_from_info(info, next_url)
+        state.current = None
+        self.refresh_idle(guild)
+
+    async def resolve_queued(self, guild_id: int, state: GuildMusicState, queued: Track) -> Track:
+        """resolve_track, retrying extractions that timed out."""
+        for attempt in range(1, PLAYER_RESOLVE_ATTEMPTS + 1):
+            try:
+                return await self.resolve_track(guild_id, state, queued)
+            except asyncio.TimeoutError:
+                if attempt == PLAYER_RESOLVE_ATTEMPTS:
+                    raise
+                print(f"[Music] Extraction timed out for {queued.url}; retrying ({attempt}/{PLAYER_RESOLVE_ATTEMPTS})")
+
+    async def start_track(self, guild: discord.Guild, state: GuildMusicState, track: Track,
+                          start_at: float, posted: Optional[float]):
         state.current = track
+        self.title_indexes.setdefault(guild.id, TitleIndex()).add(track.url, track.title)
 
         # Ensure voice connection
         vc = await self.ensure_voice(guild, state)
         if not vc:
             # Can't connect, drop track
-            state.queue.pop(0)
+            state.queue.popleft()
             state.current = None
             return
 
+        # Count the play; download popular tracks in the background
+        video_id = youtube_video_id(track.url)
+        if self.audio_cache and video_id and self.audio_cache.record_play(video_id):
+            asyncio.create_task(self.audio_cache.download(video_id, replace(track)))
+
+        # Measure loudness once; later plays reuse the cached value
+        if LOUDNESS_NORMALIZE and np is not None and video_id and track.loudness is None:
+            asyncio.create_task(self.measure_loudness(video_id, track))
+
         # Prepare source
-        source = FFmpegPCMAudio(
-            track.source_url,
-            executable=FFMPEG_EXECUTABLE,
-            **FFMPEG_OPTIONS,
-        )
+        source = self.make_source(track, state.volume, start_at=start_at, guild_id=guild.id)
 
-        # Reset idle timer
-        state.idle_time = 0
+        # Runs on discord.py's audio thread: only hand the event to the player, never wait on it
+        loop = asyncio.get_running_loop()
 
-        # Define callback for when track finishes
         def after_playback(error: Optional[Exception]):
             if error:
                 print(f"[Music] Playback error in guild {guild.id}: {error}")
-            # This runs in a different thread — use run_coroutine_threadsafe
-            fut = asyncio.run_coroutine_threadsafe(self.on_track_end(guild.id), self.bot.loop)
             try:
-                fut.result()
-            except Exception as e:
-                print(f"[Music] Error in on_track_end: {e}")
+                loop.call_soon_threadsafe(self.post_event, guild.id, state, "ended", track, time.perf_counter())
+            except RuntimeError:
+                pass  # loop already closed during shutdown
 
         # Start playing
         try:
-            vc.play(
-                discord.PCMVolumeTransformer(source, volume=state.volume),
-                after=after_playback,
-            )
+            vc.play(source, after=after_playback)
         except Exception as e:
             if state.text_channel:
                 asyncio.create_task(state.text_channel.send(f"❌ Error playing audio: `{e}`"))
+            self.refresh_idle(guild)
             return
 
-        # Send now playing embed
-        if state.text_channel:
-            embed = discord.Embed(
-                title="Now Playing",
-                description=f"[{track.title}]({track.url})",
-                color=discord.Color.blurple(),
-            )
-            if track.thumbnail:
-                embed.set_thumbnail(url=track.thumbnail)
-            msg = await state.text_channel.send(embed=embed)
-            state.now_playing_msg = msg
-
-        # Start progress updater loop
-        asyncio.create_task(self.update_progress(guild.id))
-
-    async def on_track_end(self, guild_id: int):
-        guild = self.bot.get_guild(guild_id)
-        if not guild:
-            return
-
-        state = self.get_state(guild)
-        # Remove the finished track from queue
-        if state.queue:
-            state.queue.pop(0)
-
-        # Play next if queue not empty
-        if state.queue:
-            await self.play_next_track(guild)
-        else:
-            state.current = None
-            state.idle_time = 0
-
-    async def update_progress(self, guild_id: int):
-        """Update "Now Playing" message with a text progress bar."""
-        guild = self.bot.get_guild(guild_id)
-        if not guild:
-            return
+        if posted is not None:
+            latency = time.perf_counter() - posted
+            state.transitions.append(latency)
+            if latency > PLAYER_SLOW_TRANSITION:
+                print(f"[Music] Slow track change in guild {guild.id}: {latency:.2f}s for {track.url}")
 
-        state = self.get_state(guild)
-        msg = state.now_playing_msg
-        track = state.current
+        self.refresh_idle(guild)
 
-        if not msg or not track:
-            return
+        state.started_at = time.time() - start_at
 
-        vc = guild.voice_client
-        if not vc:
-            return
-
-        duration = track.duration
-        start_time = asyncio.get_event_loop().time()
-
-        while True:
-            await asyncio.sleep(5)
-
-            vc = guild.voice_client
-            if not vc or not vc.is_connected() or not (vc.is_playing() or vc.is_paused()):
-                break
-
-            elapsed = asyncio.get_event_loop().time() - start_time
-
-            if duration:
-                bar_len = 20
-                filled_len = min(int((elapsed / duration) * bar_len), bar_len)
-                bar = "█" * filled_len + "─" * (bar_len - filled_len)
-                progress_text = f"[{bar}] {self.format_duration(elapsed)} / {self.format_duration(duration)}"
-            else:
-                progress_text = f"Elapsed: {self.format_duration(elapsed)}"
+        # Resolve what comes next while this one plays
+        self.schedule_lookahead(guild)
 
+        # Send now playing embed
+        if state.text_channel:
             embed = discord.Embed(
                 title="Now Playing",
                 description=f"[{track.title}]({track.url})",
@@ -322,12 +2572,12 @@ class Music(commands.Cog):
             )
             if track.thumbnail:
                 embed.set_thumbnail(url=track.thumbnail)
-            embed.add_field(name="Progress", value=progress_text, inline=False)
+            msg = await state.text_channel.send(embed=embed)
+            state.now_playing_msg = msg
 
-            try:
-                await msg.edit(embed=embed)
-            except Exception:
-                break
+        # Hand the message to the shared progress scheduler (replaces any previous one)
+        if state.now_playing_msg:
+            self.progress.start(guild.id, state.now_playing_msg, track, elapsed=start_at)
 
     # ------------------------
     # COMMANDS
@@ -349,31 +2599,28 @@ class Music(commands.Cog):
         # Remember text channel & voice channel
         state.text_channel = interaction.channel
         state.voice_channel_id = interaction.user.voice.channel.id
+        self.journal.write("channels", guild.id, state.voice_channel_id, interaction.channel.id)
 
         urls_to_add: List[str] = []
 
         # Handle Spotify
-        if "open.spotify.com" in url:
+        spotify = _SPOTIFY_RE.search(url)
+        if spotify and spotify.group(1) != "track":
+            # Playlists, albums and artists stream into the queue as they resolve
+            return await self.import_spotify_collection(interaction, spotify.group(1), url)
+        elif spotify:
             try:
-                if "track" in url:
-                    track = self.sp.track(url)
-                    query = f"{track['name']} {track['artists'][0]['name']}"
-                    yt_url = await self.search_youtube(query)
-                    if yt_url:
-                        urls_to_add.append(yt_url)
-
-                elif "playlist" in url:
-                    results = self.sp.playlist_items(url)
-                    for item in results["items"]:
-                        t = item.get("track")
-                        if not t:
-                            continue
-                        query = f"{t['name']} {t['artists'][0]['name']}"
-                        yt_url = await self.search_youtube(query)
-                        if yt_url:
-                            urls_to_add.append(yt_url)
+                track = await self.spotify_call(self.sp.track, url)
+                yt_url = await self.map_spotify_track(guild.id, track)
+                if yt_url:
+                    urls_to_add.append(yt_url)
             except Exception as e:
                 return await interaction.followup.send(f"Failed to process Spotify URL: {e}")
+        elif "open.spotify.com" in url:
+            return await interaction.followup.send("Unsupported Spotify URL. Use a track, playlist, album or artist link.")
+        elif youtube_playlist_id(url):
+            # Listed flat and queued page by page; videos resolve as they come up
+            return await self.import_youtube_playlist(interaction, url)
         else:
             urls_to_add.append(url)
 
@@ -383,11 +2630,12 @@ class Music(commands.Cog):
         # Resolve basic Track entries (with dummy source_url, we fill real one when playing)
         for u in urls_to_add:
             # For queue display we only need URL and maybe title (we'll show URL if unknown)
-            state.queue.append(Track(url=u, source_url="", title=u, thumbnail=None, duration=None))
+            state.queue.append(self.make_queued_track(u))
 
         await interaction.followup.send(f"Added {len(urls_to_add)} song(s) to the queue.")
 
         await self.start_playback_if_needed(guild)
+        self.schedule_lookahead(guild)
 
     # ------------------------
     # SEARCH COMMAND
@@ -407,23 +2655,31 @@ class Music(commands.Cog):
         state = self.get_state(guild)
         state.text_channel = interaction.channel
         state.voice_channel_id = interaction.user.voice.channel.id
+        self.journal.write("channels", guild.id, state.voice_channel_id, interaction.channel.id)
+
+        # A title picked from autocomplete arrives as its URL: queue it directly
+        if query.startswith(("http://", "https://")):
+            track = self.make_queued_track(query)
+            state.queue.append(track)
+            await interaction.followup.send(f"Added to queue: {track.title}")
+            await self.start_playback_if_needed(guild)
+            self.schedule_lookahead(guild)
+            return
 
         page_size = 5
 
         async def get_results(q: str):
-            ydl_opts = {
-                "format": "bestaudio",
-                "noplaylist": True,
-                "quiet": True,
-                "extract_flat": True,
-            }
-            with YoutubeDL(ydl_opts) as ydl:
-                try:
-                    info = ydl.extract_info(f"ytsearch{page_size}:{q}", download=False)
-                    return info["entries"]
-                except Exception as e:
-                    print(f"yt-dlp search error: {e}")
-                    return []
+            cached = self.search_cache.get(q)
+            if cached is not None:
+                return cached
+            try:
+                info = await self.resolver.extract(guild.id, f"ytsearch{page_size}:{q}", "search_flat")
+                results = list(info["entries"])
+            except Exception as e:
+                print(f"yt-dlp search error: {e}")
+                return []
+            self.search_cache.put(q, results)
+            return results
 
         def make_embed(results):
             embed = discord.Embed(
@@ -505,6 +2761,29 @@ class Music(commands.Cog):
         await interaction.followup.send(f"Added to queue: {title}")
 
         await self.start_playback_if_needed(guild)
+        self.schedule_lookahead(guild)
+
+    # ------------------------
+    # AUTOCOMPLETE
+    # ------------------------
+
+    def title_choices(self, guild_id: Optional[int], current: str) -> List[app_commands.Choice[str]]:
+        index = self.title_indexes.get(guild_id)
+        if not index:
+            return []
+        return [
+            app_commands.Choice(name=title[:100], value=url)
+            for url, title in index.search(current)
+            if len(url) <= 100
+        ]
+
+    @play.autocomplete("url")
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self.title_choices(interaction.guild_id, current)
+
+    @search.autocomplete("query")
+    async def search_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self.title_choices(interaction.guild_id, current)
 
     # ------------------------
     # SIMPLE CONTROL COMMANDS
@@ -514,10 +2793,19 @@ class Music(commands.Cog):
     @app_commands.guilds(discord.Object(id=GUILD_ID))
     async def skip(self, interaction: discord.Interaction):
         guild = interaction.guild
+        state = self.get_state(guild)
         vc = guild.voice_client
-        if vc and vc.is_playing():
+        if vc and (vc.is_playing() or vc.is_paused()):
+            # The after-callback tells the player to move on
+            self.progress.cancel(guild.id)
             vc.stop()
             await interaction.response.send_message("Skipped!")
+        elif state.queue:
+            # Still resolving the track being skipped: abandon it (and the
+            # look-ahead) but leave a running playlist import's searches alone
+            self.resolver.cancel_guild(guild.id, "playback")
+            self.post_event(guild.id, state, "skip", state.queue[0])
+            await interaction.response.send_message("Skipped!")
         else:
             await interaction.response.send_message("Nothing is playing!")
 
@@ -528,6 +2816,7 @@ class Music(commands.Cog):
         vc = guild.voice_client
         if vc and vc.is_playing():
             vc.pause()
+            self.refresh_idle(guild)
             await interaction.response.send_message("Paused!")
         else:
             await interaction.response.send_message("Nothing is playing!")
@@ -539,6 +2828,7 @@ class Music(commands.Cog):
         vc = guild.voice_client
         if vc and vc.is_paused():
             vc.resume()
+            self.refresh_idle(guild)
             await interaction.response.send_message("Resumed!")
         else:
             await interaction.response.send_message("Nothing is paused!")
@@ -555,8 +2845,19 @@ class Music(commands.Cog):
         state.volume = percent / 100
 
         vc = guild.voice_client
-        if vc and isinstance(vc.source, discord.PCMVolumeTransformer):
-            vc.source.volume = state.volume
+        source = vc.source if vc else None
+        if isinstance(source, TrackedSource):
+            if isinstance(source.inner, (discord.PCMVolumeTransformer, NormalizedPCMSource)):
+                source.inner.volume = state.volume
+            elif isinstance(source.inner, RemoteOpusSource):
+                # The worker applies it (restarting ffmpeg itself for passthrough)
+                source.inner.set("volume", state.volume)
+            elif source.passthrough and state.current and (vc.is_playing() or vc.is_paused()):
+                # ffmpeg owns the volume here: restart it at the current position
+                new_source = self.make_source(state.current, state.volume, start_at=source.position,
+                                              guild_id=guild.id)
+                vc.source = new_source
+                source.cleanup()
 
         await interaction.response.send_message(f"Volume set to {percent}%.")
 
@@ -574,26 +2875,48 @@ class Music(commands.Cog):
         else:
             await interaction.response.send_message("Invalid position!")
 
+    @app_commands.command(name="move", description="Move a song to another position in the queue")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    @app_commands.describe(position="Current position (starting at 1)", new_position="New position")
+    async def move(self, interaction: discord.Interaction, position: int, new_position: int):
+        guild = interaction.guild
+        state = self.get_state(guild)
+        queue = state.queue
+
+        # Position 1 is the song that is playing right now
+        first = 2 if state.current else 1
+        if not (first <= position <= len(queue) and first <= new_position <= len(queue)):
+            return await interaction.response.send_message("Invalid position!")
+
+        queue.move(position - 1, new_position - 1)
+        self.schedule_lookahead(guild)
+        await interaction.response.send_message(f"Moved {queue[new_position - 1].title} to position {new_position}.")
+
+    @app_commands.command(name="shuffle", description="Shuffle the upcoming songs")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    async def shuffle(self, interaction: discord.Interaction):
+        guild = interaction.guild
+        state = self.get_state(guild)
+
+        first = 1 if state.current else 0
+        if len(state.queue) - first < 2:
+            return await interaction.response.send_message("Not enough songs to shuffle!")
+
+        state.queue.shuffle(start=first)
+        self.schedule_lookahead(guild)
+        await interaction.response.send_message("Shuffled the queue.")
+
     @app_commands.command(name="queue", description="Show the current queue")
     @app_commands.guilds(discord.Object(id=GUILD_ID))
     async def queue_cmd(self, interaction: discord.Interaction):
         guild = interaction.guild
         state = self.get_state(guild)
-        queue = state.queue
 
-        if not queue:
+        if not state.queue:
             return await interaction.response.send_message("Queue is empty!")
 
-        embed = discord.Embed(title="Queue", color=discord.Color.green())
-        for i, track in enumerate(queue, start=1):
-            title = track.title or track.url
-            embed.add_field(
-                name=f"{i}.",
-                value=f"[{title}]({track.url})",
-                inline=False,
-            )
-
-        await interaction.response.send_message(embed=embed)
+        view = QueueView(state.queue)
+        await interaction.response.send_message(embed=view.render(), view=view)
 
     @app_commands.command(name="nowplaying", description="Show currently playing song")
     @app_commands.guilds(discord.Object(id=GUILD_ID))
@@ -626,6 +2949,14 @@ class Music(commands.Cog):
         state = self.get_state(guild)
         vc = guild.voice_client
 
+        # Drop any extraction still running for this guild
+        self.resolver.cancel_guild(guild.id)
+        self.progress.cancel(guild.id)
+        self.idle.disarm(guild.id)
+        if state.lookahead_task:
+            state.lookahead_task.cancel()
+            state.lookahead_task = None
+
         if vc:
             if vc.is_playing() or vc.is_paused():
                 vc.stop()
@@ -634,17 +2965,133 @@ class Music(commands.Cog):
         # Clear state
         state.queue.clear()
         state.current = None
-        state.idle_time = 0
         state.now_playing_msg = None
         state.voice_channel_id = None
+        self.journal.write("channels", guild.id, None, None)
 
         await interaction.response.send_message("Disconnected and cleared the queue.")
 
+    @app_commands.command(name="musiccache", description="OWNER ONLY — Show track cache statistics")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    async def music_cache(self, interaction: discord.Interaction):
+        app = await self.bot.application_info()
+        if interaction.user.id != app.owner.id:
+            return await interaction.response.send_message(
+                "❌ You are **not authorised** to view cache statistics.",
+                ephemeral=True
+            )
+
+        stats = self.track_cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        rate = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+
+        embed = discord.Embed(title="Track Cache", color=discord.Color.gold())
+        embed.add_field(name="Hits (yt-dlp calls saved)", value=stats["hits"])
+        embed.add_field(name="Misses", value=stats["misses"])
+        embed.add_field(name="Hit rate", value=rate)
+        embed.add_field(name="In memory", value=f"{stats['memory']} / {self.track_cache.max_entries}")
+        embed.add_field(name="On disk", value=stats["disk"])
+
+        index = self.spotify_index.stats()
+        embed.add_field(
+            name="Spotify index",
+            value=f"{index['size']} mapped, {index['hits']} searches saved, {index['misses']} misses",
+            inline=False,
+        )
+
+        transitions = sorted(t for state in self.states.values() for t in state.transitions)
+        if transitions:
+            p95 = transitions[min(len(transitions) - 1, int(len(transitions) * 0.95))]
+            embed.add_field(
+                name="Track changes",
+                value=f"{len(transitions)} recent — median {transitions[len(transitions) // 2]:.2f}s, "
+                      f"p95 {p95:.2f}s, max {transitions[-1]:.2f}s",
+                inline=False,
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="audiocache", description="OWNER ONLY — Show local audio cache occupancy")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    async def audio_cache_cmd(self, interaction: discord.Interaction):
+        app = await self.bot.application_info()
+        if interaction.user.id != app.owner.id:
+            return await interaction.response.send_message(
+                "❌ You are **not authorised** to view cache statistics.",
+                ephemeral=True
+            )
+        if not self.audio_cache:
+            return await interaction.response.send_message("The audio cache is disabled.", ephemeral=True)
+
+        stats = self.audio_cache.stats()
+        plays = stats["hits"] + stats["misses"]
+        rate = f"{stats['hits'] / plays:.0%}" if plays else "n/a"
+        used_mb = stats["bytes"] / 1024 ** 2
+        budget_mb = self.audio_cache.budget / 1024 ** 2
+
+        embed = discord.Embed(title="Audio Cache", color=discord.Color.gold())
+        embed.add_field(name="Occupancy", value=f"{used_mb:.0f} / {budget_mb:.0f} MB ({stats['files']} files)")
+        embed.add_field(name="Hit rate", value=f"{rate} ({stats['hits']} of {plays} plays)")
+        embed.add_field(name="Downloading", value=len(self.audio_cache.downloading))
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="spotifywarm", description="OWNER ONLY — Pre-map a Spotify collection to YouTube")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    @app_commands.describe(url="Spotify playlist, album or artist URL")
+    async def spotify_warm(self, interaction: discord.Interaction, url: str):
+        app = await self.bot.application_info()
+        if interaction.user.id != app.owner.id:
+            return await interaction.response.send_message(
+                "❌ You are **not authorised** to warm the Spotify index.",
+                ephemeral=True
+            )
+
+        spotify = _SPOTIFY_RE.search(url)
+        if not spotify or spotify.group(1) == "track":
+            return await interaction.response.send_message(
+                "Use a Spotify playlist, album or artist URL.", ephemeral=True
+            )
+
+        await interaction.response.defer(thinking=True, ephemeral=True)
+
+        guild_id = interaction.guild.id
+        sem = asyncio.Semaphore(SPOTIFY_IMPORT_CONCURRENCY)
+        counts = {"known": 0, "mapped": 0, "failed": 0}
+
+        async def warm_one(t: dict):
+            try:
+                if self.spotify_index.lookup(t):
+                    counts["known"] += 1
+                elif await self.map_spotify_track(guild_id, t):
+                    counts["mapped"] += 1
+                else:
+                    counts["failed"] += 1
+            except Exception:
+                counts["failed"] += 1
+            finally:
+                sem.release()
+
+        tasks = []
+        try:
+            async for t in self.spotify_collection(spotify.group(1), url):
+                await sem.acquire()
+                tasks.append(asyncio.create_task(warm_one(t)))
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            return await interaction.followup.send(f"Failed to process Spotify URL: {e}", ephemeral=True)
+
+        await interaction.followup.send(
+            f"Spotify index warmed: {counts['mapped']} newly mapped, "
+            f"{counts['known']} already known, {counts['failed']} not found.",
+            ephemeral=True,
+        )
+
     @app_commands.command(name="musichelp", description="Show all music commands")
     @app_commands.guilds(discord.Object(id=GUILD_ID))
     async def music_help(self, interaction: discord.Interaction):
         embed = discord.Embed(title="Music Bot Commands", color=discord.Color.gold())
-        embed.add_field(name="/play <URL>", value="Play a YouTube/Spotify track or playlist", inline=False)
+        embed.add_field(name="/play <URL>", value="Play a YouTube/Spotify track, playlist, album or artist", inline=False)
         embed.add_field(name="/search <query>", value="Search YouTube and pick a result", inline=False)
         embed.add_field(name="/queue", value="Show queue", inline=False)
         embed.add_field(name="/nowplaying", value="Show current song", inline=False)
@@ -653,40 +3100,168 @@ class Music(commands.Cog):
         embed.add_field(name="/resume", value="Resume playback", inline=False)
         embed.add_field(name="/volume <0-100>", value="Set playback volume", inline=False)
         embed.add_field(name="/remove <pos>", value="Remove a song from queue", inline=False)
+        embed.add_field(name="/move <pos> <new_pos>", value="Move a song within the queue", inline=False)
+        embed.add_field(name="/shuffle", value="Shuffle the upcoming songs", inline=False)
         embed.add_field(name="/leave", value="Disconnect bot and clear queue", inline=False)
+        embed.add_field(name="/idletimeout <seconds>", value="Set how long to wait before leaving when idle", inline=False)
         await interaction.response.send_message(embed=embed)
 
     # ------------------------
-    # IDLE DISCONNECT
+    # CACHE DATABASE
     # ------------------------
 
-    @tasks.loop(seconds=10)
-    async def idle_checker(self):
-        """Disconnect from voice if idle for 120 seconds."""
-        for guild in list(self.bot.guilds):
-            state = self.states.get(guild.id)
-            if not state:
-                continue
+    @tasks.loop(seconds=CACHE_FLUSH_INTERVAL)
+    async def flush_caches(self):
+        for store in (self.track_cache, self.spotify_index, self.audio_cache):
+            if store:
+                await store.flush()
 
-            vc = guild.voice_client
-            if vc and vc.is_connected():
-                if not vc.is_playing() and not vc.is_paused():
-                    state.idle_time += 10
-                    if state.idle_time >= 120:
-                        try:
-                            await vc.disconnect()
-                        except Exception:
-                            pass
-                        state.idle_time = 0
-                        state.queue.clear()
-                        state.current = None
-                        state.now_playing_msg = None
-                else:
-                    state.idle_time = 0
+    # ------------------------
+    # QUEUE JOURNAL
+    # ------------------------
 
-    @idle_checker.before_loop
-    async def before_idle_checker(self):
+    def restore_states(self, saved: Dict[int, dict]) -> Dict[int, dict]:
+        """Rebuild GuildMusicState from the journal; returns guilds to resume playing."""
+        resume = {}
+        for guild_id, g in saved.items():
+            if not g["queue"]:
+                continue
+            state = GuildMusicState(queue=TrackQueue(QueueJournal.unpack(t) for t in g["queue"]))
+            state.voice_channel_id = g["voice"]
+            state.queue.listener = lambda op, *args, gid=guild_id: self.journal.write(op, gid, *args)
+            self.states[guild_id] = state
+            if g["voice"]:
+                resume[guild_id] = g
+        return resume
+
+    def journal_snapshot(self) -> Dict[int, dict]:
+        guilds = {}
+        for guild_id, state in self.states.items():
+            g = QueueJournal.empty_guild()
+            g["queue"] = [QueueJournal.pack(t) for t in state.queue]
+            g["voice"] = state.voice_channel_id
+            g["text"] = getattr(state.text_channel, "id", None)
+            g["pos"] = self.playback_position(guild_id)
+            guilds[guild_id] = g
+        return guilds
+
+    def playback_position(self, guild_id: int) -> float:
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        source = vc.source if vc else None
+        return source.position if isinstance(source, TrackedSource) else 0.0
+
+    @tasks.loop(seconds=JOURNAL_CHECKPOINT_INTERVAL)
+    async def journal_checkpoint(self):
+        """Record play positions and compact the journal when it grows large."""
+        for guild_id, state in self.states.items():
+            if state.current:
+                position = self.playback_position(guild_id)
+                if position:
+                    self.journal.write("pos", guild_id, round(position, 1))
+
+        if self.journal.ops >= JOURNAL_COMPACT_OPS:
+            self.journal.compact(self.journal_snapshot())
+
+    @journal_checkpoint.before_loop
+    async def before_journal_checkpoint(self):
         await self.bot.wait_until_ready()
+        await self.resume_from_journal()
+
+    async def resume_from_journal(self):
+        pending, self.pending_resume = self.pending_resume, {}
+        for guild_id, g in pending.items():
+            guild = self.bot.get_guild(guild_id)
+            state = self.states.get(guild_id)
+            if not guild or not state or not state.queue:
+                continue
+
+            channel = guild.get_channel(g["text"]) if g["text"] else None
+            state.text_channel = channel
+            if channel:
+                try:
+                    await channel.send(f"🔁 Resuming the queue after a restart ({len(state.queue)} song(s)).")
+                except Exception:
+                    pass
+            self.post_event(guild_id, state, "play", g["pos"])
+
+    # ------------------------
+    # IDLE DISCONNECT
+    # ------------------------
+
+    def refresh_idle(self, guild: discord.Guild):
+        """Arm or disarm the guild's idle deadline from its current voice state.
+
+        Idle means connected but stopped, paused, or alone in the channel.
+        """
+        vc = guild.voice_client
+        if not vc or not vc.is_connected():
+            self.idle.disarm(guild.id)
+            return
+
+        alone = not any(not m.bot for m in vc.channel.members)
+        if alone or not vc.is_playing():
+            self.idle.arm(guild.id, self.get_state(guild).idle_timeout)
+        else:
+            self.idle.disarm(guild.id)
+
+    async def on_idle_timeout(self, guild_id: int):
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return
+
+        # Re-check: something may have changed without an event reaching us
+        vc = guild.voice_client
+        if vc and vc.is_connected():
+            alone = not any(not m.bot for m in vc.channel.members)
+            if vc.is_playing() and not alone:
+                return
+            try:
+                await vc.disconnect()
+            except Exception:
+                pass
+
+        state = self.states.get(guild_id)
+        if state:
+            self.resolver.cancel_guild(guild_id)
+            state.queue.clear()
+            state.current = None
+            state.now_playing_msg = None
+        self.progress.cancel(guild_id)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
+                                    after: discord.VoiceState):
+        guild = member.guild
+        if member.id == self.bot.user.id and after.channel is None:
+            # We were disconnected (or left)
+            self.idle.disarm(guild.id)
+            return
+
+        vc = guild.voice_client
+        if not vc or vc.channel not in (before.channel, after.channel):
+            return
+        self.refresh_idle(guild)
+
+    @app_commands.command(name="idletimeout", description="Set how long the bot stays idle in voice before leaving")
+    @app_commands.guilds(discord.Object(id=GUILD_ID))
+    @app_commands.describe(seconds="Seconds to wait while stopped, paused or alone (30–3600)")
+    async def idle_timeout(self, interaction: discord.Interaction, seconds: int):
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message(
+                "❌ You need **Manage Server** to change this.",
+                ephemeral=True
+            )
+        if not 30 <= seconds <= 3600:
+            return await interaction.response.send_message("Timeout must be between 30 and 3600 seconds.")
+
+        guild = interaction.guild
+        self.get_state(guild).idle_timeout = seconds
+        # Apply to a countdown that is already running
+        if self.idle.is_armed(guild.id):
+            self.idle.arm(guild.id, seconds, restart=True)
+
+        await interaction.response.send_message(f"Idle timeout set to {seconds} seconds.")
 
 
 async def setup(bot: commands.Bot):
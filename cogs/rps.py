@@ -1,49 +1,1075 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-import json, os
+import asyncio, bisect, heapq, json, math, os, sqlite3, threading, time
+
+try:
+    import numpy as np
+except ImportError:  # only needed for /rpsretune
+    np = None
+
+STATS_DB = "rps_stats.db"
+LEGACY_STATS_FILE = "rps_stats.json"   # imported once into STATS_DB
+STATS_FLUSH_INTERVAL = 2.0             # seconds between batched writes
+LEADERBOARD_PAGE_SIZE = 10
+GLOBAL_AGGREGATE = True                # also keep all-server totals (the "global" leaderboard)
+LEGACY_GUILD_ID = 1435711020680347688  # guild the stats from before per-guild partitioning belong to
+GAME_TTL = 300                         # seconds a challenge stays open (restarted on accept)
+GAME_SWEEP_INTERVAL = 15               # seconds between expiry sweeps
+
+ELO_INITIAL = 1000.0
+ELO_K = 24.0                           # rating points moved by a fully unexpected result
+REPLAY_MIN_LAYER = 512                 # matches per layer (x K values) worth a NumPy step in replay_elo
+
+OPTIONS = ("Rock", "Paper", "Scissors")
+EMOJI_MAP = {"Rock": "🪨", "Paper": "📄", "Scissors": "✂️"}
+
+
+# -----------------------------------
+# Rank Index
+# -----------------------------------
+class RankIndex:
+    """Players in leaderboard order, kept sorted as their stats change.
+
+    Keys are (-wins, -ties, user_id), so ascending order is rank order.
+    They live in sorted blocks with a Fenwick tree over the block sizes:
+    rank() is O(log n), insert/remove are O(log n + BLOCK_SIZE), and a
+    leaderboard page is read without touching the rest.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.blocks = [keys[i:i + self.BLOCK_SIZE] for i in range(0, len(keys), self.BLOCK_SIZE)]
+        self._rebuild()
+
+    @staticmethod
+    def key(user_id, stats):
+        return (-stats["wins"], -stats["ties"], user_id)
+
+    def _rebuild(self):
+        self.maxes = [block[-1] for block in self.blocks]
+        n = len(self.blocks)
+        tree = [0] * (n + 1)
+        for i, block in enumerate(self.blocks, start=1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.size = sum(len(block) for block in self.blocks)
+
+    def _add(self, block_index, delta):
+        i = block_index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, block_index):
+        """Number of keys in blocks before `block_index`."""
+        total, i = 0, block_index
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, key):
+        if not self.blocks:
+            self.blocks = [[key]]
+            return self._rebuild()
+        bi = min(bisect.bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[bi]
+        bisect.insort(block, key)
+        self.maxes[bi] = block[-1]
+        self.size += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self.blocks[bi:bi + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self._rebuild()
+        else:
+            self._add(bi, 1)
+
+    def remove(self, key):
+        bi = bisect.bisect_left(self.maxes, key)
+        block = self.blocks[bi]
+        del block[bisect.bisect_left(block, key)]
+        self.size -= 1
+        if block:
+            self.maxes[bi] = block[-1]
+            self._add(bi, -1)
+        else:
+            del self.blocks[bi]
+            self._rebuild()
+
+    def rank(self, key):
+        """0-based position of `key` (where it would go if absent)."""
+        bi = bisect.bisect_left(self.maxes, key)
+        if bi == len(self.blocks):
+            return self.size
+        return self._prefix(bi) + bisect.bisect_left(self.blocks[bi], key)
+
+    def slice(self, start, stop):
+        """Keys ranked start..stop-1."""
+        # Descend the Fenwick tree to the block holding `start`
+        pos, rem = 0, start
+        step = 1 << (len(self.blocks).bit_length() - 1) if self.blocks else 0
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= rem:
+                pos = nxt
+                rem -= self.tree[nxt]
+            step >>= 1
+
+        out = []
+        want = stop - start
+        for block in self.blocks[pos:]:
+            out.extend(block[rem:rem + want - len(out)])
+            rem = 0
+            if len(out) >= want:
+                break
+        return out
+
+    def clear(self):
+        self.blocks = []
+        self._rebuild()
+
+
+# -----------------------------------
+# Stats Store
+# -----------------------------------
+class Partition:
+    """W/L/T counters and rank index for one guild (or the global aggregate)."""
+
+    def __init__(self, rows=()):
+        self.stats = {uid: {"wins": w, "losses": l, "ties": t} for uid, w, l, t in rows}
+        self.ranks = RankIndex(RankIndex.key(uid, s) for uid, s in self.stats.items())
+
+    def get(self, user_id):
+        return self.stats.get(user_id)
+
+    def rank(self, user_id):
+        """1-based leaderboard rank, or None for players without games."""
+        stats = self.stats.get(user_id)
+        return self.ranks.rank(RankIndex.key(user_id, stats)) + 1 if stats else None
+
+    def add(self, user_id, delta):
+        """Apply a (wins, losses, ties) delta; players back at zero are dropped."""
+        stats = self.stats.get(user_id)
+        if stats is None:
+            stats = self.stats[user_id] = {"wins": 0, "losses": 0, "ties": 0}
+        else:
+            self.ranks.remove(RankIndex.key(user_id, stats))
+        for field, n in zip(StatsStore.FIELDS, delta):
+            stats[field] += n
+        if any(stats.values()):
+            self.ranks.insert(RankIndex.key(user_id, stats))
+        else:
+            del self.stats[user_id]
+
+
+class StatsStore:
+    """W/L/T counters per (guild, user) in SQLite (WAL), plus a global aggregate.
+
+    Each guild's counters are loaded into a Partition on first use, so a
+    query only ever costs as much as that guild's player count. The global
+    aggregate (guild_id None) lives in its own table and is updated with
+    the same deltas rather than recomputed.
+
+    Updates change loaded partitions immediately and queue a delta;
+    flush() writes all queued deltas in one transaction from a worker
+    thread, so finishing a game never touches the disk on the event loop.
+    """
+
+    FIELDS = ("wins", "losses", "ties")
+
+    UPSERT_GUILD = (
+        "INSERT INTO guild_stats (guild_id, user_id, wins, losses, ties) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT(guild_id, user_id) DO UPDATE SET"
+        " wins = wins + excluded.wins,"
+        " losses = losses + excluded.losses,"
+        " ties = ties + excluded.ties"
+    )
+    UPSERT_GLOBAL = (
+        "INSERT INTO stats (user_id, wins, losses, ties) VALUES (?, ?, ?, ?)"
+        " ON CONFLICT(user_id) DO UPDATE SET"
+        " wins = wins + excluded.wins,"
+        " losses = losses + excluded.losses,"
+        " ties = ties + excluded.ties"
+    )
+
+    def __init__(self, path=STATS_DB, global_aggregate=GLOBAL_AGGREGATE):
+        self.global_aggregate = global_aggregate
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()        # serialises use of the connection across threads
+        self.write_lock = asyncio.Lock()    # one flush/reset at a time
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS guild_stats ("
+            " guild_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " wins INTEGER NOT NULL DEFAULT 0,"
+            " losses INTEGER NOT NULL DEFAULT 0,"
+            " ties INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID"
+        )
+        # Global aggregate (this was the only table before stats were per guild)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS stats ("
+            " user_id INTEGER PRIMARY KEY,"
+            " wins INTEGER NOT NULL DEFAULT 0,"
+            " losses INTEGER NOT NULL DEFAULT 0,"
+            " ties INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        self.migrate()
+
+        self.partitions = {}    # { guild_id or None: Partition }, loaded on first use
+        self.pending = {}       # { (guild_id, user_id): [wins, losses, ties] } not yet on disk
+        self.inflight = None    # batch being written right now
+
+    def migrate(self):
+        flags = {key for (key,) in self.db.execute("SELECT key FROM meta")}
+        with self.db:
+            if "partitioned" not in flags:
+                # Stats from before the split were all recorded in the bot's home guild
+                self.db.execute(
+                    "INSERT OR IGNORE INTO guild_stats (guild_id, user_id, wins, losses, ties)"
+                    " SELECT ?, user_id, wins, losses, ties FROM stats",
+                    (LEGACY_GUILD_ID,),
+                )
+                self.db.execute("INSERT INTO meta (key, value) VALUES ('partitioned', '1')")
+            if not self.global_aggregate:
+                self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('global_stale', '1')")
+            elif "global_stale" in flags:
+                # Aggregate was switched off for a while: rebuild it once
+                self.db.execute("DELETE FROM stats")
+                self.db.execute(
+                    "INSERT INTO stats (user_id, wins, losses, ties)"
+                    " SELECT user_id, SUM(wins), SUM(losses), SUM(ties) FROM guild_stats GROUP BY user_id"
+                )
+                self.db.execute("DELETE FROM meta WHERE key = 'global_stale'")
+
+    def partition(self, guild_id):
+        """Stats for one guild, or the global aggregate for guild_id None."""
+        part = self.partitions.get(guild_id)
+        if part is not None:
+            return part
+
+        with self.lock:
+            if guild_id is None:
+                rows = self.db.execute("SELECT user_id, wins, losses, ties FROM stats").fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT user_id, wins, losses, ties FROM guild_stats WHERE guild_id = ?", (guild_id,)
+                ).fetchall()
+            unsaved = [self.pending] + ([self.inflight] if self.inflight else [])
+
+        part = Partition(rows)
+        # Deltas that haven't reached the table yet
+        for batch in unsaved:
+            for (gid, uid), delta in batch.items():
+                if guild_id is None or gid == guild_id:
+                    part.add(uid, delta)
+        self.partitions[guild_id] = part
+        return part
+
+    def add(self, guild_id, user_id, key):
+        delta = [0, 0, 0]
+        delta[self.FIELDS.index(key)] = 1
+        for gid in (guild_id, None) if self.global_aggregate else (guild_id,):
+            part = self.partitions.get(gid)
+            if part is not None:
+                part.add(user_id, delta)
+        pending = self.pending.setdefault((guild_id, user_id), [0, 0, 0])
+        for i, n in enumerate(delta):
+            pending[i] += n
+
+    def _upsert(self, batch):
+        # Caller holds self.lock inside a transaction
+        self.db.executemany(self.UPSERT_GUILD, [(gid, uid, *d) for (gid, uid), d in batch.items()])
+        if self.global_aggregate:
+            totals = {}
+            for (_, uid), delta in batch.items():
+                t = totals.setdefault(uid, [0, 0, 0])
+                for i, n in enumerate(delta):
+                    t[i] += n
+            self.db.executemany(self.UPSERT_GLOBAL, [(uid, *t) for uid, t in totals.items()])
+
+    def _write(self, batch):
+        with self.lock:
+            with self.db:
+                self._upsert(batch)
+            self.inflight = None
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            self.inflight = batch
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                print(f"[RPS] Failed to save stats, will retry: {e}")
+                self.inflight = None
+                for key, delta in batch.items():
+                    merged = self.pending.setdefault(key, [0, 0, 0])
+                    for i, n in enumerate(delta):
+                        merged[i] += n
+
+    def flush_now(self):
+        """Blocking flush for shutdown."""
+        batch, self.pending = self.pending, {}
+        if batch:
+            self._write(batch)
+
+    async def reset(self, guild_id):
+        """Wipe one guild's stats and take them back out of the global aggregate."""
+        async with self.write_lock:
+            part = self.partition(guild_id)     # complete, including unsaved deltas
+            batch, self.pending = self.pending, {}
+            self.inflight = batch
+            removed = [(uid, s["wins"], s["losses"], s["ties"]) for uid, s in part.stats.items()]
+
+            def wipe():
+                with self.lock:
+                    with self.db:
+                        self._upsert(batch)
+                        if self.global_aggregate:
+                            self.db.executemany(
+                                "UPDATE stats SET wins = wins - ?, losses = losses - ?, ties = ties - ?"
+                                " WHERE user_id = ?",
+                                [(w, l, t, uid) for uid, w, l, t in removed],
+                            )
+                            self.db.execute("DELETE FROM stats WHERE wins = 0 AND losses = 0 AND ties = 0")
+                        self.db.execute("DELETE FROM guild_stats WHERE guild_id = ?", (guild_id,))
+                    self.inflight = None
+
+            await asyncio.to_thread(wipe)
+
+            # Games finished during the wipe are only in pending; they belong in the new partition
+            fresh = Partition()
+            for (gid, uid), delta in self.pending.items():
+                if gid == guild_id:
+                    fresh.add(uid, delta)
+            self.partitions[guild_id] = fresh
+            everyone = self.partitions.get(None)
+            if everyone is not None:
+                for uid, w, l, t in removed:
+                    everyone.add(uid, (-w, -l, -t))
+
+    def import_json(self, path=LEGACY_STATS_FILE):
+        """One-shot import of the old JSON stats file (skipped once done)."""
+        if not os.path.exists(path):
+            return
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return
+
+        # The old file can hold the same user twice (int and str keys both
+        # dumped as strings); add the duplicates up rather than keep the last
+        merged = {}
+
+        def collect(pairs):
+            if not all(k in self.FIELDS for k, _ in pairs):
+                for k, v in pairs:
+                    totals = merged.setdefault((LEGACY_GUILD_ID, int(k)), [0, 0, 0])
+                    for i, field in enumerate(self.FIELDS):
+                        totals[i] += int(v.get(field, 0))
+            return dict(pairs)
+
+        try:
+            with open(path, "r") as f:
+                json.load(f, object_pairs_hook=collect)
+        except (ValueError, OSError) as e:
+            print(f"[RPS] Could not import {path}: {e}")
+            return
+
+        with self.lock, self.db:
+            self._upsert(merged)
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (path,))
+        self.partitions.clear()
+        print(f"[RPS] Imported stats for {len(merged)} players from {path}")
+
+    def close(self):
+        self.flush_now()
+        self.db.close()
+
+
+# -----------------------------------
+# Match Log & Ratings
+# -----------------------------------
+def outcome(p1_choice, p2_choice):
+    """Score for player 1: 1 win, 0.5 tie, 0 loss (choices index OPTIONS)."""
+    # Each option beats the one before it, so the index difference decides the game
+    return (0.5, 1.0, 0.0)[(p1_choice - p2_choice) % 3]
+
+
+def elo_delta(r1, r2, score, k=ELO_K):
+    """Rating change for player 1 (player 2 moves by the negative)."""
+    expected = 1.0 / (1.0 + 10.0 ** ((r2 - r1) / 400.0))
+    return k * (score - expected)
+
+
+def match_layers(p1, p2, n_players):
+    """Group matches into layers that share no player, keeping each player's order.
+
+    Replaying layer by layer gives exactly the same ratings as replaying
+    match by match, but every layer can be updated as one vector op.
+    """
+    last = [-1] * n_players
+    layers = [0] * len(p1)
+    for i, (a, b) in enumerate(zip(p1.tolist(), p2.tolist())):
+        layer = max(last[a], last[b]) + 1
+        layers[i] = last[a] = last[b] = layer
+    return np.asarray(layers, dtype=np.int64)
+
+
+def replay_scalar(p1, p2, score, n_players, k, initial=ELO_INITIAL):
+    """replay_elo one match at a time, for logs whose layers are too small to vectorize."""
+    ratings = np.empty((len(k), n_players))
+    loss = np.zeros(len(k))
+    matches = list(zip(p1.tolist(), p2.tolist(), score.tolist()))
+    for row, factor in enumerate(k.tolist()):
+        r = [initial] * n_players
+        predicted = [0.0] * len(matches)
+        for i, (a, b, s) in enumerate(matches):
+            expected = predicted[i] = 1.0 / (1.0 + 10.0 ** ((r[b] - r[a]) / 400.0))
+            delta = factor * (s - expected)
+            r[a] += delta
+            r[b] -= delta
+        ratings[row] = r
+        e = np.asarray(predicted)
+        loss[row] = -(score * np.log(e + 1e-12) + (1 - score) * np.log(1 - e + 1e-12)).sum()
+    return ratings, loss / max(len(matches), 1)
+
+
+def replay_elo(p1, p2, score, n_players, k=ELO_K, initial=ELO_INITIAL):
+    """Replay a whole match log with NumPy, for one or many K values at once.
+
+    p1/p2 are player indexes and score player 1's result, all in match
+    order. Returns (ratings with shape (len(k), n_players), mean log loss
+    of the pre-match predictions per K) — lower loss means better-tuned K.
+
+    A layer holds at most n_players / 2 matches, so a log with few, busy
+    players (one guild's regulars) has tiny layers; below REPLAY_MIN_LAYER
+    the per-step NumPy overhead loses to a plain loop, which is used instead.
+    """
+    k = np.atleast_1d(np.asarray(k, dtype=np.float64))
+    ratings = np.full((len(k), n_players), initial, dtype=np.float64)
+    loss = np.zeros(len(k))
+    if not len(p1):
+        return ratings, loss
+
+    # Every layer holds at most one game of the busiest player, which bounds
+    # the average layer size without building the layers
+    busiest = np.bincount(np.concatenate([p1, p2]), minlength=n_players).max()
+    if len(p1) / busiest * len(k) < REPLAY_MIN_LAYER:
+        return replay_scalar(p1, p2, score, n_players, k, initial)
+
+    layers = match_layers(p1, p2, n_players)
+    if len(p1) / (layers.max() + 1) * len(k) < REPLAY_MIN_LAYER:
+        return replay_scalar(p1, p2, score, n_players, k, initial)
+
+    order = np.argsort(layers, kind="stable")
+    bounds = np.searchsorted(layers[order], np.arange(layers[order[-1]] + 2))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        idx = order[start:stop]
+        a, b, s = p1[idx], p2[idx], score[idx]
+        expected = 1.0 / (1.0 + 10.0 ** ((ratings[:, b] - ratings[:, a]) / 400.0))
+        eps = 1e-12
+        loss -= (s * np.log(expected + eps) + (1 - s) * np.log(1 - expected + eps)).sum(axis=1)
+        delta = k[:, None] * (s - expected)
+        # No player appears twice in a layer, so plain fancy-index updates are safe
+        ratings[:, a] += delta
+        ratings[:, b] -= delta
+    return ratings, loss / len(p1)
+
+
+class MatchLog:
+    """Append-only log of finished games plus the indexes built from it.
+
+    - matches: every game (guild, players, choices, time), appended in batches
+    - ratings: Elo rating, games and win/loss streaks per (guild, user),
+      updated incrementally per match and kept in memory per guild
+    - head_to_head: per-pair W/L/T, read by primary key
+
+    Like StatsStore, writes are queued and flushed from a worker thread.
+    """
+
+    def __init__(self, path=STATS_DB, k=ELO_K):
+        self.k = k
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.write_lock = asyncio.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS matches ("
+            " id INTEGER PRIMARY KEY,"
+            " guild_id INTEGER NOT NULL,"
+            " p1_id INTEGER NOT NULL,"
+            " p2_id INTEGER NOT NULL,"
+            " p1_choice INTEGER NOT NULL,"
+            " p2_choice INTEGER NOT NULL,"
+            " played_at INTEGER NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ratings ("
+            " guild_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " rating REAL NOT NULL,"
+            " games INTEGER NOT NULL DEFAULT 0,"
+            " streak INTEGER NOT NULL DEFAULT 0,"      # +n wins / -n losses in a row
+            " best_streak INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS head_to_head ("
+            " guild_id INTEGER NOT NULL,"
+            " low_id INTEGER NOT NULL,"
+            " high_id INTEGER NOT NULL,"
+            " low_wins INTEGER NOT NULL DEFAULT 0,"
+            " high_wins INTEGER NOT NULL DEFAULT 0,"
+            " ties INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (guild_id, low_id, high_id)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS head_to_head_high ON head_to_head (guild_id, high_id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        # A K picked by /rpsretune outlives restarts
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'elo_k'").fetchone()
+        if row:
+            self.k = float(row[0])
+
+        self.ratings = {}       # { guild_id: { user_id: [rating, games, streak, best_streak] } }
+        self.pending_matches = []
+        self.pending_h2h = {}   # { (guild_id, low, high): [low_wins, high_wins, ties] }
+        self.dirty = set()      # (guild_id, user_id) with unsaved ratings
+        self.inflight_h2h = None
+
+    # -- ratings --
+
+    def guild_ratings(self, guild_id):
+        table = self.ratings.get(guild_id)
+        if table is None:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT user_id, rating, games, streak, best_streak FROM ratings WHERE guild_id = ?",
+                    (guild_id,),
+                ).fetchall()
+            table = self.ratings[guild_id] = {uid: list(rest) for uid, *rest in rows}
+        return table
+
+    def rating(self, guild_id, user_id):
+        """[rating, games, streak, best_streak], or None before the first match."""
+        return self.guild_ratings(guild_id).get(user_id)
+
+    def record(self, guild_id, p1_id, p2_id, p1_choice, p2_choice, played_at=None):
+        self.pending_matches.append(
+            (guild_id, p1_id, p2_id, p1_choice, p2_choice, int(played_at or time.time()))
+        )
+        score = outcome(p1_choice, p2_choice)
+
+        table = self.guild_ratings(guild_id)
+        r1 = table.setdefault(p1_id, [ELO_INITIAL, 0, 0, 0])
+        r2 = table.setdefault(p2_id, [ELO_INITIAL, 0, 0, 0])
+        delta = elo_delta(r1[0], r2[0], score, self.k)
+        r1[0] += delta
+        r2[0] -= delta
+        for r, s in ((r1, score), (r2, 1.0 - score)):
+            r[1] += 1
+            if s == 0.5:
+                r[2] = 0
+            elif s == 1.0:
+                r[2] = r[2] + 1 if r[2] > 0 else 1
+            else:
+                r[2] = r[2] - 1 if r[2] < 0 else -1
+            r[3] = max(r[3], r[2])
+        self.dirty.update(((guild_id, p1_id), (guild_id, p2_id)))
+
+        low, high = min(p1_id, p2_id), max(p1_id, p2_id)
+        pair = self.pending_h2h.setdefault((guild_id, low, high), [0, 0, 0])
+        if score == 0.5:
+            pair[2] += 1
+        else:
+            winner = p1_id if score == 1.0 else p2_id
+            pair[0 if winner == low else 1] += 1
+
+    # -- head to head --
+
+    def head_to_head(self, guild_id, user_id, other_id):
+        """(user wins, other wins, ties) between two players in a guild."""
+        low, high = min(user_id, other_id), max(user_id, other_id)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT low_wins, high_wins, ties FROM head_to_head"
+                " WHERE guild_id = ? AND low_id = ? AND high_id = ?",
+                (guild_id, low, high),
+            ).fetchone()
+            unsaved = [self.pending_h2h] + ([self.inflight_h2h] if self.inflight_h2h else [])
+        totals = list(row) if row else [0, 0, 0]
+        for batch in unsaved:
+            for i, n in enumerate(batch.get((guild_id, low, high), ())):
+                totals[i] += n
+        low_wins, high_wins, ties = totals
+        return (low_wins, high_wins, ties) if user_id == low else (high_wins, low_wins, ties)
+
+    def rivals(self, guild_id, user_id, limit=3):
+        """Most-played opponents as [(other_id, (user wins, other wins, ties))]."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT high_id FROM head_to_head WHERE guild_id = ? AND low_id = ?"
+                " UNION ALL SELECT low_id FROM head_to_head WHERE guild_id = ? AND high_id = ?",
+                (guild_id, user_id, guild_id, user_id),
+            ).fetchall()
+        others = {other for (other,) in rows}
+        for batch in [self.pending_h2h] + ([self.inflight_h2h] if self.inflight_h2h else []):
+            for gid, low, high in batch:
+                if gid == guild_id and user_id in (low, high):
+                    others.add(high if low == user_id else low)
+        records = [(other, self.head_to_head(guild_id, user_id, other)) for other in others]
+        records.sort(key=lambda r: sum(r[1]), reverse=True)
+        return records[:limit]
+
+    # -- persistence --
+
+    def _write(self, matches, h2h, ratings):
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO matches (guild_id, p1_id, p2_id, p1_choice, p2_choice, played_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    matches,
+                )
+                self.db.executemany(
+                    "INSERT INTO head_to_head (guild_id, low_id, high_id, low_wins, high_wins, ties)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT(guild_id, low_id, high_id) DO UPDATE SET"
+                    " low_wins = low_wins + excluded.low_wins,"
+                    " high_wins = high_wins + excluded.high_wins,"
+                    " ties = ties + excluded.ties",
+                    [(*key, *counts) for key, counts in h2h.items()],
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO ratings (guild_id, user_id, rating, games, streak, best_streak)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    ratings,
+                )
+            self.inflight_h2h = None
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending_matches and not self.dirty:
+                return
+            matches, self.pending_matches = self.pending_matches, []
+            h2h, self.pending_h2h = self.pending_h2h, {}
+            # Ratings are written as snapshots of the in-memory rows
+            ratings = [(gid, uid, *self.ratings[gid][uid]) for gid, uid in self.dirty]
+            self.dirty = set()
+            self.inflight_h2h = h2h
+            try:
+                await asyncio.to_thread(self._write, matches, h2h, ratings)
+            except Exception as e:
+                print(f"[RPS] Failed to save match log, will retry: {e}")
+                self.inflight_h2h = None
+                self.pending_matches = matches + self.pending_matches
+                for key, counts in h2h.items():
+                    merged = self.pending_h2h.setdefault(key, [0, 0, 0])
+                    for i, n in enumerate(counts):
+                        merged[i] += n
+                self.dirty.update((gid, uid) for gid, uid, *_ in ratings)
+
+    def flush_now(self):
+        """Blocking flush for shutdown."""
+        matches, self.pending_matches = self.pending_matches, []
+        h2h, self.pending_h2h = self.pending_h2h, {}
+        ratings = [(gid, uid, *self.ratings[gid][uid]) for gid, uid in self.dirty]
+        self.dirty = set()
+        if matches or ratings:
+            self._write(matches, h2h, ratings)
+
+    async def reset(self, guild_id):
+        async with self.write_lock:
+            self.pending_matches = [m for m in self.pending_matches if m[0] != guild_id]
+            self.pending_h2h = {key: c for key, c in self.pending_h2h.items() if key[0] != guild_id}
+            self.dirty = {key for key in self.dirty if key[0] != guild_id}
+            self.ratings[guild_id] = {}
+
+            def wipe():
+                with self.lock, self.db:
+                    for table in ("matches", "ratings", "head_to_head"):
+                        self.db.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+
+            await asyncio.to_thread(wipe)
+
+    # -- offline recompute --
+
+    def load_log(self):
+        """The whole log as arrays for replay_elo (call after flushing)."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT guild_id, p1_id, p2_id, p1_choice, p2_choice FROM matches ORDER BY id"
+            ).fetchall()
+        log = np.asarray(rows, dtype=np.int64).reshape(-1, 5)
+        # Ratings are per guild, so a player index is a (guild, user) pair
+        pairs = np.concatenate([log[:, [0, 1]], log[:, [0, 2]]])
+        players, index = np.unique(pairs, axis=0, return_inverse=True)
+        index = index.reshape(-1)
+        p1, p2 = index[:len(log)], index[len(log):]
+        score = np.choose((log[:, 3] - log[:, 4]) % 3, [0.5, 1.0, 0.0])
+        return players, p1, p2, score
+
+    async def apply_ratings(self, players, ratings, k):
+        """Replace every rating with replayed values (streaks are kept)."""
+        self.k = k
+        rows = [(float(r), int(g), int(u)) for (g, u), r in zip(players.tolist(), ratings.tolist())]
+
+        def write():
+            with self.lock, self.db:
+                self.db.executemany("UPDATE ratings SET rating = ? WHERE guild_id = ? AND user_id = ?", rows)
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('elo_k', ?)", (str(k),))
+
+        async with self.write_lock:
+            await asyncio.to_thread(write)
+        for rating, gid, uid in rows:
+            row = self.ratings.get(gid, {}).get(uid)
+            if row:
+                row[0] = rating
+
+    def close(self):
+        self.flush_now()
+        self.db.close()
+
+
+# -----------------------------------
+# Game Manager
+# -----------------------------------
+class Game:
+    """One pending challenge. Choices are indexes into OPTIONS."""
+
+    __slots__ = ("guild_id", "challenger_id", "opponent_id", "channel_id", "message_id",
+                 "accepted", "challenger_choice", "opponent_choice", "expires_at")
+
+    def __init__(self, guild_id, challenger_id, opponent_id, channel_id, message_id=None,
+                 accepted=False, challenger_choice=None, opponent_choice=None, expires_at=0.0):
+        self.guild_id = guild_id
+        self.challenger_id = challenger_id
+        self.opponent_id = opponent_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.accepted = bool(accepted)
+        self.challenger_choice = challenger_choice
+        self.opponent_choice = opponent_choice
+        self.expires_at = expires_at
+
+    @property
+    def key(self):
+        return (self.guild_id, min(self.challenger_id, self.opponent_id), max(self.challenger_id, self.opponent_id))
+
+
+class GameManager:
+    """Pending games by (guild, low id, high id), persisted so they survive restarts.
+
+    Expiry deadlines sit in one heap that a single timer sweeps; entries
+    for games that were finished or extended are skipped when popped.
+
+    The in-memory table is authoritative. Changes are queued per game and
+    written from a worker thread by flush(), alongside the stats.
+    """
+
+    COLUMNS = ("guild_id", "challenger_id", "opponent_id", "channel_id", "message_id",
+               "accepted", "challenger_choice", "opponent_choice", "expires_at")
+
+    def __init__(self, path=STATS_DB):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.write_lock = asyncio.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS games ("
+            " guild_id INTEGER NOT NULL,"
+            " low_id INTEGER NOT NULL,"
+            " high_id INTEGER NOT NULL,"
+            " challenger_id INTEGER NOT NULL,"
+            " opponent_id INTEGER NOT NULL,"
+            " channel_id INTEGER NOT NULL,"
+            " message_id INTEGER,"
+            " accepted INTEGER NOT NULL DEFAULT 0,"
+            " challenger_choice INTEGER,"
+            " opponent_choice INTEGER,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (guild_id, low_id, high_id)) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+        self.games = {}
+        self.deadlines = []     # heap of (expires_at, key)
+        for row in self.db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM games"):
+            game = Game(*row)
+            self.games[game.key] = game
+            self.deadlines.append((game.expires_at, game.key))
+        heapq.heapify(self.deadlines)
+        self.pending = {}       # { key: Game to write, or None to delete }
+
+    def __len__(self):
+        return len(self.games)
+
+    def get(self, key):
+        return self.games.get(key)
+
+    def save(self, game):
+        """Insert or update a game (also after changing its expiry)."""
+        self.games[game.key] = game
+        heapq.heappush(self.deadlines, (game.expires_at, game.key))
+        self.pending[game.key] = game
+
+    def update(self, game):
+        """Persist a choice/accept without touching the expiry heap."""
+        self.pending[game.key] = game
+
+    def pop(self, key):
+        game = self.games.pop(key, None)
+        if game is not None:
+            self.pending[key] = None
+        return game
+
+    def expire(self, now):
+        """Remove and return every game whose deadline has passed."""
+        expired = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, key = heapq.heappop(self.deadlines)
+            game = self.games.get(key)
+            if game is not None and game.expires_at <= now:
+                expired.append(self.pop(key))
+        return expired
+
+    def _rows(self, batch):
+        # Snapshot on the loop thread so the worker never reads a live Game
+        upserts = [
+            (key[1], key[2], *(getattr(game, c) for c in self.COLUMNS))
+            for key, game in batch.items() if game is not None
+        ]
+        deletes = [key for key, game in batch.items() if game is None]
+        return upserts, deletes
+
+    def _write(self, upserts, deletes):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM games WHERE guild_id = ? AND low_id = ? AND high_id = ?", deletes)
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO games (low_id, high_id, {', '.join(self.COLUMNS)})"
+                f" VALUES (?, ?{', ?' * len(self.COLUMNS)})",
+                upserts,
+            )
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            try:
+                await asyncio.to_thread(self._write, *self._rows(batch))
+            except Exception as e:
+                print(f"[RPS] Failed to save games, will retry: {e}")
+                # Anything changed since is newer than this batch
+                for key, game in batch.items():
+                    self.pending.setdefault(key, game)
+
+    def close(self):
+        batch, self.pending = self.pending, {}
+        if batch:
+            self._write(*self._rows(batch))
+        self.db.close()
+
+
+class RPSButton(discord.ui.DynamicItem[discord.ui.Button],
+                template=r"rps:(?P<action>[a-z]+):(?P<guild>\d+):(?P<low>\d+):(?P<high>\d+)"):
+    """Every RPS button. The custom_id carries the action and game key, so
+    buttons keep working after a restart without any per-game view."""
+
+    def __init__(self, action, key, label=None, style=discord.ButtonStyle.primary):
+        super().__init__(discord.ui.Button(
+            label=label, style=style, custom_id=f"rps:{action}:{key[0]}:{key[1]}:{key[2]}",
+        ))
+        self.action = action
+        self.key = key
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        key = (int(match["guild"]), int(match["low"]), int(match["high"]))
+        return cls(match["action"], key, item.label, item.style)
+
+    async def callback(self, interaction: discord.Interaction):
+        cog = interaction.client.get_cog("RPS")
+        if cog:
+            await cog.on_game_button(interaction, self.action, self.key)
+
+
+def choice_view(key):
+    view = discord.ui.View(timeout=None)
+    for opt in OPTIONS:
+        view.add_item(RPSButton(opt.lower(), key, EMOJI_MAP[opt]))
+    return view
+
+
+def challenge_view(key):
+    view = discord.ui.View(timeout=None)
+    view.add_item(RPSButton("accept", key, "Accept", discord.ButtonStyle.success))
+    view.add_item(RPSButton("decline", key, "Decline", discord.ButtonStyle.danger))
+    return view
+
+
+# -----------------------------------
+# Leaderboard View
+# -----------------------------------
+class LeaderboardView(discord.ui.View):
+    """Button-paginated /rpsleaderboard. Only the visible page is formatted."""
+
+    def __init__(self, cog, part, guild, viewer_id, title):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.part = part
+        self.guild = guild
+        self.viewer_id = viewer_id
+        self.title = title
+        self.page = 0
+
+    def page_count(self):
+        return max(1, math.ceil(len(self.part.ranks) / LEADERBOARD_PAGE_SIZE))
+
+    def render(self):
+        part = self.part
+        # Stats may have changed since the last click
+        self.page = min(self.page, self.page_count() - 1)
+        start = self.page * LEADERBOARD_PAGE_SIZE
+
+        lines = []
+        for rank, (_, _, uid) in enumerate(part.ranks.slice(start, start + LEADERBOARD_PAGE_SIZE), start=start + 1):
+            stats = part.get(uid)
+            name = self.cog.display_name(self.guild, uid)
+            lines.append(f"**#{rank} {name}** — {stats['wins']}W / {stats['losses']}L / {stats['ties']}T")
+
+        embed = discord.Embed(title=self.title)
+        embed.description = "\n".join(lines) or "No games have been played yet."
+        footer = f"Page {self.page + 1}/{self.page_count()} • {len(part.ranks)} player(s)"
+        my_rank = part.rank(self.viewer_id)
+        if my_rank:
+            footer += f" • Your rank: #{my_rank}"
+        embed.set_footer(text=footer)
+        return embed
+
+    async def show(self, interaction, page):
+        self.page = max(0, min(page, self.page_count() - 1))
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="⏮", style=discord.ButtonStyle.secondary)
+    async def first_page(self, i: discord.Interaction, _):
+        await self.show(i, 0)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.primary)
+    async def previous_page(self, i: discord.Interaction, _):
+        await self.show(i, self.page - 1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.primary)
+    async def next_page(self, i: discord.Interaction, _):
+        await self.show(i, self.page + 1)
+
+    @discord.ui.button(label="⏭", style=discord.ButtonStyle.secondary)
+    async def last_page(self, i: discord.Interaction, _):
+        await self.show(i, self.page_count() - 1)
+
 
 class RPS(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
         # Game storage
-        self.rps_games = {}     # { (guild, p1, p2): {"choices": {uid: "Rock"}} }
-        self.rps_stats = {}     # { user_id: {wins:0, losses:0, ties:0} }
-        self.SAVE_FILE = "rps_stats.json"
+        self.games = GameManager()
+        bot.add_dynamic_items(RPSButton)
+        self.stats = StatsStore()
+        self.stats.import_json()
+        self.matches = MatchLog()
+        self.names = {}         # { (guild_id, user_id): display name } for leaderboard pages
+
+        self.flush_stats.start()
+        self.sweep_games.start()
+
+    def cog_unload(self):
+        self.sweep_games.cancel()
+        self.bot.remove_dynamic_items(RPSButton)
+        self.games.close()
+        self.flush_stats.cancel()
+        self.stats.close()
+        self.matches.close()
 
-        self.load_stats()
+    # -----------------------------------
+    # Save Stats (write-behind)
+    # -----------------------------------
+    @tasks.loop(seconds=STATS_FLUSH_INTERVAL)
+    async def flush_stats(self):
+        await self.stats.flush()
+        await self.matches.flush()
+        await self.games.flush()
 
     # -----------------------------------
-    # Save/Load Stats
+    # Display Names
     # -----------------------------------
-    def save_stats(self):
-        with open(self.SAVE_FILE, "w") as f:
-            json.dump(self.rps_stats, f)
-
-    def load_stats(self):
-        if os.path.exists(self.SAVE_FILE):
-            with open(self.SAVE_FILE, "r") as f:
-                try:
-                    self.rps_stats = json.load(f)
-                except:
-                    self.rps_stats = {}
+    def display_name(self, guild, user_id):
+        key = (guild.id if guild else None, user_id)
+        name = self.names.get(key)
+        if name is None:
+            # Global leaderboards list people from other servers too
+            person = (guild.get_member(user_id) if guild else None) or self.bot.get_user(user_id)
+            if not person:
+                return f"User {user_id}"
+            name = self.names[key] = person.display_name
+        return name
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        key = (after.guild.id, after.id)
+        if key in self.names:
+            self.names[key] = after.display_name
 
     # -----------------------------------
     def get_key(self, guild_id, p1, p2):
         return (guild_id, min(p1, p2), max(p1, p2))
 
-    def update_stats(self, winner_id=None, loser_id=None, tie_ids=None):
+    def update_stats(self, guild_id, winner_id=None, loser_id=None, tie_ids=None):
+        # Memory only; flush_stats writes it out shortly after
         if tie_ids:
             for uid in tie_ids:
-                self.rps_stats.setdefault(uid, {"wins": 0, "losses": 0, "ties": 0})
-                self.rps_stats[uid]["ties"] += 1
+                self.stats.add(guild_id, uid, "ties")
         else:
             for uid, key in [(winner_id, "wins"), (loser_id, "losses")]:
-                self.rps_stats.setdefault(uid, {"wins": 0, "losses": 0, "ties": 0})
-                self.rps_stats[uid][key] += 1
+                self.stats.add(guild_id, uid, key)
+
+    # -----------------------------------
+    # Game Expiry
+    # -----------------------------------
+    @tasks.loop(seconds=GAME_SWEEP_INTERVAL)
+    async def sweep_games(self):
+        for game in self.games.expire(time.time()):
+            await self.close_challenge(game, "⌛ This Rock Paper Scissors challenge expired.")
+
+    @sweep_games.before_loop
+    async def before_sweep_games(self):
+        await self.bot.wait_until_ready()
 
-        self.save_stats()
+    async def close_challenge(self, game, text):
+        """Replace the public challenge message's buttons with `text`."""
+        channel = self.bot.get_channel(game.channel_id)
+        if not channel or not game.message_id:
+            return
+        try:
+            await channel.get_partial_message(game.message_id).edit(content=text, view=None)
+        except discord.HTTPException:
+            pass
 
     # -----------------------------------
     # /rpscancel
@@ -51,9 +1077,10 @@ class RPS(commands.Cog):
     @app_commands.command(name="rpscancel", description="Cancel your active RPS game with someone.")
     async def rpscancel(self, interaction: discord.Interaction, opponent: discord.Member):
         key = self.get_key(interaction.guild.id, interaction.user.id, opponent.id)
-        if key in self.rps_games:
-            self.rps_games.pop(key)
+        game = self.games.pop(key)
+        if game:
             await interaction.response.send_message("Game cancelled.", ephemeral=True)
+            await self.close_challenge(game, "🚫 This Rock Paper Scissors challenge was cancelled.")
         else:
             await interaction.response.send_message("No active game with that user.", ephemeral=True)
 
@@ -64,163 +1091,132 @@ class RPS(commands.Cog):
     async def rps(self, interaction: discord.Interaction, opponent: discord.Member):
 
         challenger = interaction.user
-        guild = interaction.guild
-        gid = guild.id
+        gid = interaction.guild.id
 
         if challenger.id == opponent.id:
             return await interaction.response.send_message("You cannot challenge yourself.", ephemeral=True)
 
         key = self.get_key(gid, challenger.id, opponent.id)
 
-        if key in self.rps_games:
+        if self.games.get(key):
             return await interaction.response.send_message("A game between you two already exists!", ephemeral=True)
 
         # Create game
-        self.rps_games[key] = {"choices": {}}
-
-        emoji_map = {"Rock": "🪨", "Paper": "📄", "Scissors": "✂️"}
-        options = ["Rock", "Paper", "Scissors"]
-
-        # ---------------------------------------
-        # Challenger Choice UI
-        # ---------------------------------------
-        class ChallengerView(discord.ui.View):
-            def __init__(self, cog):
-                super().__init__(timeout=300)
-                self.cog = cog
-
-            async def choose(self, interaction_btn: discord.Interaction, choice: str):
-                self.cog.rps_games[key]["choices"][challenger.id] = choice
-                await interaction_btn.response.send_message(
-                    f"You chose {emoji_map[choice]}",
-                    ephemeral=True
-                )
-                self.stop()
-
-        cv = ChallengerView(self)
-
-        for opt in options:
-            btn = discord.ui.Button(label=emoji_map[opt], style=discord.ButtonStyle.primary)
-
-            async def callback(ibtn: discord.Interaction, choice=opt):
-                if ibtn.user.id != challenger.id:
-                    return await ibtn.response.send_message("This button isn't for you.", ephemeral=True)
-                await cv.choose(ibtn, choice)
-
-            btn.callback = callback
-            cv.add_item(btn)
+        game = Game(gid, challenger.id, opponent.id, interaction.channel.id, expires_at=time.time() + GAME_TTL)
+        self.games.save(game)
 
+        # Challenger picks privately; the opponent gets Accept/Decline in the channel
         await interaction.response.send_message(
             f"{challenger.mention}, choose your move:",
-            view=cv,
+            view=choice_view(key),
             ephemeral=True
         )
 
-        # ---------------------------------------
-        # Opponent Accept/Decline
-        # ---------------------------------------
-        class AcceptDecline(discord.ui.View):
-            def __init__(self, cog):
-                super().__init__(timeout=300)
-                self.cog = cog
-                self.message = None
+        challenge_msg = await interaction.channel.send(
+            f"{opponent.mention}, **{challenger.display_name}** challenged you to Rock Paper Scissors!",
+            view=challenge_view(key)
+        )
+        game.message_id = challenge_msg.id
+        self.games.update(game)
 
-            @discord.ui.button(label="Accept", style=discord.ButtonStyle.success)
-            async def accept(self, i: discord.Interaction, _):
-                if i.user.id != opponent.id:
-                    return await i.response.send_message("Not your challenge.", ephemeral=True)
+    # -----------------------------------
+    # Buttons (dispatched by RPSButton)
+    # -----------------------------------
+    async def on_game_button(self, i: discord.Interaction, action, key):
+        game = self.games.get(key)
+        if game is None:
+            return await i.response.send_message("This game has expired or was cancelled.", ephemeral=True)
 
-                for c in self.children:
-                    c.disabled = True
-                await self.message.edit(view=self)
+        if action in ("accept", "decline"):
+            if i.user.id != game.opponent_id:
+                return await i.response.send_message("Not your challenge.", ephemeral=True)
 
-                await i.response.send_message("Challenge accepted! Check your private message.", ephemeral=True)
-                await send_opponent_choice(i)
+            if action == "decline":
+                self.games.pop(key)
+                return await i.response.edit_message(
+                    content=f"{i.user.mention} declined the Rock Paper Scissors challenge.", view=None
+                )
 
-            @discord.ui.button(label="Decline", style=discord.ButtonStyle.danger)
-            async def decline(self, i: discord.Interaction, _):
-                if i.user.id != opponent.id:
-                    return await i.response.send_message("Not your challenge.", ephemeral=True)
+            if game.accepted:
+                return await i.response.send_message("You already accepted.", ephemeral=True)
+            game.accepted = True
+            game.expires_at = time.time() + GAME_TTL
+            self.games.save(game)
 
-                self.cog.rps_games.pop(key, None)
-                await i.response.send_message("Challenge declined.", ephemeral=True)
+            await i.response.edit_message(view=None)
+            return await i.followup.send(
+                f"{i.user.mention}, choose your move:",
+                view=choice_view(key),
+                ephemeral=True
+            )
 
-        adv = AcceptDecline(self)
+        choice = next((n for n, opt in enumerate(OPTIONS) if opt.lower() == action), None)
+        if choice is None:
+            return await i.response.send_message("Unknown button.", ephemeral=True)
 
-        challenge_msg = await interaction.channel.send(
-            f"{opponent.mention}, **{challenger.display_name}** challenged you to Rock Paper Scissors!",
-            view=adv
+        if i.user.id == game.challenger_id:
+            slot = "challenger_choice"
+        elif i.user.id == game.opponent_id:
+            if not game.accepted:
+                return await i.response.send_message("Accept the challenge first.", ephemeral=True)
+            slot = "opponent_choice"
+        else:
+            return await i.response.send_message("This button isn't for you.", ephemeral=True)
+
+        if getattr(game, slot) is not None:
+            return await i.response.send_message("You already chose.", ephemeral=True)
+        setattr(game, slot, choice)
+
+        # Decided before any await: only the click that completes the game
+        # sees both choices, and settle_game claims it synchronously
+        result = None
+        if game.challenger_choice is None or game.opponent_choice is None:
+            self.games.update(game)
+        else:
+            result = self.settle_game(game)
+
+        # Acknowledge first so a slow channel send can't blow the interaction deadline
+        await i.response.send_message(f"You chose {EMOJI_MAP[OPTIONS[choice]]}", ephemeral=True)
+
+        if result:
+            channel = i.channel or self.bot.get_channel(game.channel_id)
+            if channel:
+                await channel.send(result)
+
+    def settle_game(self, game):
+        """Claim a finished game and record it; returns the result text (None if already gone)."""
+        # Already finished, cancelled or expired
+        if self.games.pop(game.key) is None:
+            return None
+        guild = self.bot.get_guild(game.guild_id)
+        self.matches.record(
+            game.guild_id, game.challenger_id, game.opponent_id, game.challenger_choice, game.opponent_choice,
         )
-        adv.message = challenge_msg
-
-        # ---------------------------------------
-        # Opponent Choice UI
-        # ---------------------------------------
-        async def send_opponent_choice(response_interaction: discord.Interaction):
-
-            class OpponentView(discord.ui.View):
-                def __init__(self, cog):
-                    super().__init__(timeout=300)
-                    self.cog = cog
-                    self.message = None
-
-                async def choose(self, ibtn: discord.Interaction, choice: str):
-                    self.cog.rps_games[key]["choices"][opponent.id] = choice
-
-                    await ibtn.response.send_message(
-                        f"You chose {emoji_map[choice]}",
-                        ephemeral=True
-                    )
-                    self.stop()
-
-                    # If both picked, decide result
-                    choices = self.cog.rps_games[key]["choices"]
-                    if len(choices) == 2:
-                        p1_id, p2_id = key[1], key[2]
-                        p1 = guild.get_member(p1_id)
-                        p2 = guild.get_member(p2_id)
-
-                        p1c = choices[p1_id]
-                        p2c = choices[p2_id]
-
-                        # Decide winner
-                        if p1c == p2c:
-                            result = f"It's a tie! You both picked {emoji_map[p1c]}"
-                            self.cog.update_stats(tie_ids=[p1_id, p2_id])
-                        elif (
-                            (p1c == "Rock" and p2c == "Scissors")
-                            or (p1c == "Paper" and p2c == "Rock")
-                            or (p1c == "Scissors" and p2c == "Paper")
-                        ):
-                            result = f"{p1.mention} wins! {emoji_map[p1c]} beats {emoji_map[p2c]}"
-                            self.cog.update_stats(winner_id=p1_id, loser_id=p2_id)
-                        else:
-                            result = f"{p2.mention} wins! {emoji_map[p2c]} beats {emoji_map[p1c]}"
-                            self.cog.update_stats(winner_id=p2_id, loser_id=p1_id)
-
-                        await response_interaction.channel.send(result)
-
-                        self.cog.rps_games.pop(key, None)
-
-            ov = OpponentView(self)
-
-            for opt in options:
-                btn = discord.ui.Button(label=emoji_map[opt], style=discord.ButtonStyle.primary)
-
-                async def callback(ibtn: discord.Interaction, choice=opt):
-                    if ibtn.user.id != opponent.id:
-                        return await ibtn.response.send_message("Not your turn.", ephemeral=True)
-                    await ov.choose(ibtn, choice)
-
-                btn.callback = callback
-                ov.add_item(btn)
-
-            msg = await response_interaction.followup.send(
-                f"{opponent.mention}, choose your move:",
-                view=ov,
-                ephemeral=True
-            )
-            ov.message = msg
+
+        p1_id, p2_id = game.key[1], game.key[2]
+        by_player = {game.challenger_id: OPTIONS[game.challenger_choice], game.opponent_id: OPTIONS[game.opponent_choice]}
+        p1c, p2c = by_player[p1_id], by_player[p2_id]
+
+        def mention(uid):
+            member = guild.get_member(uid) if guild else None
+            return member.mention if member else f"<@{uid}>"
+
+        # Decide winner
+        if p1c == p2c:
+            result = f"It's a tie! You both picked {EMOJI_MAP[p1c]}"
+            self.update_stats(game.guild_id, tie_ids=[p1_id, p2_id])
+        elif (
+            (p1c == "Rock" and p2c == "Scissors")
+            or (p1c == "Paper" and p2c == "Rock")
+            or (p1c == "Scissors" and p2c == "Paper")
+        ):
+            result = f"{mention(p1_id)} wins! {EMOJI_MAP[p1c]} beats {EMOJI_MAP[p2c]}"
+            self.update_stats(game.guild_id, winner_id=p1_id, loser_id=p2_id)
+        else:
+            result = f"{mention(p2_id)} wins! {EMOJI_MAP[p2c]} beats {EMOJI_MAP[p1c]}"
+            self.update_stats(game.guild_id, winner_id=p2_id, loser_id=p1_id)
+
+        return result
 
     # -----------------------------------
     # /rpsstats
@@ -229,10 +1225,11 @@ class RPS(commands.Cog):
     async def rpsstats(self, interaction: discord.Interaction, member: discord.Member = None):
         user = member or interaction.user
 
-        stats = self.rps_stats.get(user.id)
+        part = self.stats.partition(interaction.guild.id)
+        stats = part.get(user.id)
         if not stats:
             return await interaction.response.send_message(
-                f"{user.display_name} has no recorded games.",
+                f"{user.display_name} has no recorded games in this server.",
                 ephemeral=True
             )
 
@@ -243,6 +1240,41 @@ class RPS(commands.Cog):
         embed.add_field(name="Wins", value=stats["wins"])
         embed.add_field(name="Losses", value=stats["losses"])
         embed.add_field(name="Ties", value=stats["ties"])
+        embed.add_field(name="Rank", value=f"#{part.rank(user.id)} of {len(part.ranks)}")
+
+        rating = self.matches.rating(interaction.guild.id, user.id)
+        if rating:
+            elo, games, streak, best = rating
+            embed.add_field(name="Rating", value=f"{elo:.0f} ({games} rated games)")
+            current = f"{streak}W" if streak > 0 else f"{-streak}L" if streak < 0 else "—"
+            embed.add_field(name="Streak", value=f"{current} (best {best}W)")
+
+        if user.id != interaction.user.id:
+            won, lost, tied = self.matches.head_to_head(interaction.guild.id, user.id, interaction.user.id)
+            if won or lost or tied:
+                embed.add_field(name="Against you", value=f"{won}W / {lost}L / {tied}T", inline=False)
+        else:
+            rivals = self.matches.rivals(interaction.guild.id, user.id)
+            if rivals:
+                embed.add_field(
+                    name="Rivals",
+                    value="\n".join(
+                        f"{self.display_name(interaction.guild, other)} — {w}W / {l}L / {t}T"
+                        for other, (w, l, t) in rivals
+                    ),
+                    inline=False,
+                )
+
+        if self.stats.global_aggregate:
+            everyone = self.stats.partition(None)
+            total = everyone.get(user.id)
+            if total and total != stats:
+                embed.add_field(
+                    name="All servers",
+                    value=f"{total['wins']}W / {total['losses']}L / {total['ties']}T "
+                          f"(#{everyone.rank(user.id)} of {len(everyone.ranks)})",
+                    inline=False,
+                )
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
@@ -250,50 +1282,103 @@ class RPS(commands.Cog):
     # /rpsleaderboard
     # -----------------------------------
     @app_commands.command(name="rpsleaderboard", description="Show the RPS leaderboard")
-    async def rpsleaderboard(self, interaction: discord.Interaction):
+    @app_commands.describe(scope="This server's leaderboard or everyone's across all servers")
+    @app_commands.choices(scope=[
+        app_commands.Choice(name="This server", value="server"),
+        app_commands.Choice(name="All servers", value="global"),
+    ])
+    async def rpsleaderboard(self, interaction: discord.Interaction, scope: str = "server"):
 
-        if not self.rps_stats:
-            return await interaction.response.send_message("No games have been played yet.", ephemeral=True)
-
-        sorted_players = sorted(
-            self.rps_stats.items(),
-            key=lambda x: (x[1]["wins"], x[1]["ties"]),
-            reverse=True
-        )
+        if scope == "global" and not self.stats.global_aggregate:
+            return await interaction.response.send_message("The global leaderboard is disabled.", ephemeral=True)
 
-        embed = discord.Embed(title="🏆 Rock Paper Scissors Leaderboard")
+        if scope == "global":
+            part = self.stats.partition(None)
+            title = "🏆 Rock Paper Scissors Leaderboard — All Servers"
+        else:
+            part = self.stats.partition(interaction.guild.id)
+            title = "🏆 Rock Paper Scissors Leaderboard"
 
-        desc = ""
-        for rank, (uid, stats) in enumerate(sorted_players, start=1):
-            member = interaction.guild.get_member(uid)
-            name = member.display_name if member else f"User {uid}"
-            desc += f"**#{rank} {name}** — {stats['wins']}W / {stats['losses']}L / {stats['ties']}T\n"
+        if not part.stats:
+            return await interaction.response.send_message("No games have been played yet.", ephemeral=True)
 
-        embed.description = desc
-        await interaction.response.send_message(embed=embed)
+        view = LeaderboardView(self, part, interaction.guild, interaction.user.id, title)
+        await interaction.response.send_message(embed=view.render(), view=view)
 		
 		
-    @app_commands.command(name="rpsreset", description="OWNER ONLY — Reset all Rock Paper Scissors stats")
+    @app_commands.command(name="rpsreset", description="Reset this server's Rock Paper Scissors stats")
     async def rpsreset(self, interaction: discord.Interaction):
 
-    # Only the bot owner may use this
+    # The bot owner or a server manager may use this
         app = await self.bot.application_info()
     
-        if interaction.user.id != app.owner.id:
+        if interaction.user.id != app.owner.id and not interaction.user.guild_permissions.manage_guild:
             return await interaction.response.send_message(
                 "❌ You are **not authorised** to reset the leaderboard.",
                 ephemeral=True
             )
 
-    # Reset stats
-        self.rps_stats = {}
-        self.save_stats()
+    # Reset this guild only (also taken out of the global totals)
+        await self.stats.reset(interaction.guild.id)
+        await self.matches.reset(interaction.guild.id)
 
         await interaction.response.send_message(
-            "🧹 **RPS leaderboard has been wiped.**",
+            "🧹 **This server's RPS leaderboard has been wiped.**",
             ephemeral=True
         )
 
+    # -----------------------------------
+    # /rpsretune
+    # -----------------------------------
+    @app_commands.command(name="rpsretune", description="Replay the match log to compare rating K-factors (owner only)")
+    @app_commands.describe(
+        k_values="Comma-separated K-factors to compare, e.g. 16,24,32",
+        apply="Rewrite every rating with the best K from this replay",
+    )
+    async def rpsretune(self, interaction: discord.Interaction, k_values: str = "16,24,32", apply: bool = False):
+
+        app = await self.bot.application_info()
+        if interaction.user.id != app.owner.id:
+            return await interaction.response.send_message("❌ Owner only.", ephemeral=True)
+
+        if np is None:
+            return await interaction.response.send_message("NumPy is not installed.", ephemeral=True)
+
+        try:
+            ks = [float(k) for k in k_values.split(",") if k.strip()]
+        except ValueError:
+            return await interaction.response.send_message("K-factors must be numbers.", ephemeral=True)
+        if not ks:
+            return await interaction.response.send_message("Give at least one K-factor.", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        await self.matches.flush()
+
+        def replay():
+            players, p1, p2, score = self.matches.load_log()
+            ratings, loss = replay_elo(p1, p2, score, len(players), ks)
+            return players, ratings, loss, len(p1)
+
+        started = time.perf_counter()
+        players, ratings, loss, count = await asyncio.to_thread(replay)
+        took = time.perf_counter() - started
+        if not count:
+            return await interaction.followup.send("No matches recorded yet.", ephemeral=True)
+
+        best = int(np.argmin(loss))
+        lines = [
+            f"K={k:g}: log loss {l:.4f}" + (" ← best" if n == best else "")
+            for n, (k, l) in enumerate(zip(ks, loss.tolist()))
+        ]
+        lines.append(f"Replayed {count} matches for {len(players)} players in {took * 1000:.0f} ms.")
+
+        if apply:
+            # Games finished during the replay aren't in it; their ratings get overwritten too
+            await self.matches.apply_ratings(players, ratings[best], ks[best])
+            lines.append(f"Ratings rebuilt with K={ks[best]:g}.")
+
+        await interaction.followup.send("\n".join(lines), ephemeral=True)
+
 
 
 async def setup(bot):
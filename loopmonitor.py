@@ -0,0 +1,162 @@
+"""
+Event-loop lag monitor.
+
+A heartbeat coroutine wakes every LOOP_MONITOR_INTERVAL and records how late
+it was scheduled. A daemon thread watches the heartbeat; once it has been
+missing for longer than LOOP_LAG_THRESHOLD, the loop is stuck inside one
+callback, so the thread grabs the loop thread's current stack. When the
+heartbeat resumes, the stall's duration is charged to that call site.
+
+Call sites are ranked by total blocked time, logged as they happen and
+available to the owner through /looplag.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+# ------------------------
+# CONFIG
+# ------------------------
+
+LOOP_MONITOR_INTERVAL = 0.05                                      # heartbeat period (seconds)
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.1"))  # stalls longer than this are captured
+LOOP_STACK_DEPTH = 8                                              # frames kept per captured stack
+
+# Frames from these files are skipped when picking a blamed call site
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class BlockingSite:
+    site: str                  # "cogs/rps.py:22 in save_stats"
+    stack: List[str]           # innermost last
+    count: int = 0
+    total: float = 0.0
+    worst: float = 0.0
+    last_seen: float = field(default_factory=time.time)
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_MONITOR_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.sites: Dict[str, BlockingSite] = {}
+        self.lock = threading.Lock()
+
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.perf_counter()
+        self.captured: Optional[Tuple[str, List[str]]] = None  # stack of the stall in progress
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    # ------------------------
+    # LIFECYCLE
+    # ------------------------
+
+    def start(self):
+        """Start monitoring the running loop (call from inside it)."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.task = self.loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name="loop-monitor", daemon=True)
+        self.thread.start()
+        print(f"[loopmonitor] Watching for loop stalls over {self.threshold * 1000:.0f} ms")
+
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+    # ------------------------
+    # HEARTBEAT (loop thread)
+    # ------------------------
+
+    async def heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self.last_beat = now
+            metrics.LOOP_LAG.observe(lag)
+
+            with self.lock:
+                captured, self.captured = self.captured, None
+            if captured:
+                self.record(captured, lag)
+
+    def record(self, captured: Tuple[str, List[str]], lag: float):
+        site, stack = captured
+        with self.lock:
+            entry = self.sites.get(site)
+            if entry is None:
+                entry = self.sites[site] = BlockingSite(site=site, stack=stack)
+            entry.count += 1
+            entry.total += lag
+            entry.worst = max(entry.worst, lag)
+            entry.last_seen = time.time()
+            entry.stack = stack
+        metrics.LOOP_STALLS.inc(site)
+        print(f"[loopmonitor] Loop blocked for {lag * 1000:.0f} ms at {site}\n" + "".join(stack))
+
+    # ------------------------
+    # SAMPLER (monitor thread)
+    # ------------------------
+
+    def watch(self):
+        # Sample a few times per threshold so short stalls are still caught mid-call
+        period = max(0.01, self.threshold / 4)
+        while not self.stopped.wait(period):
+            beat = self.last_beat
+            if time.perf_counter() - beat < self.threshold + self.interval:
+                continue
+            with self.lock:
+                if self.captured is not None:
+                    continue  # already have this stall's stack
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            captured = self.describe(frame)
+            with self.lock:
+                # Only keep it if the heartbeat hasn't come back in the meantime
+                if self.last_beat == beat:
+                    self.captured = captured
+
+    @staticmethod
+    def describe(frame) -> Tuple[str, List[str]]:
+        summary = traceback.extract_stack(frame)
+        # Blame the innermost frame in our own code; library frames below it are the "how"
+        site_frame = summary[-1]
+        for entry in reversed(summary):
+            path = os.path.abspath(entry.filename)
+            if path.startswith(PROJECT_ROOT) and path != os.path.abspath(__file__) and "site-packages" not in path:
+                site_frame = entry
+                break
+        site = f"{os.path.relpath(site_frame.filename, PROJECT_ROOT)}:{site_frame.lineno} in {site_frame.name}"
+        return site, traceback.format_list(summary[-LOOP_STACK_DEPTH:])
+
+    # ------------------------
+    # REPORT
+    # ------------------------
+
+    def report(self, limit: int = 10) -> List[BlockingSite]:
+        """Blocking call sites, worst total blocked time first."""
+        with self.lock:
+            sites = list(self.sites.values())
+        sites.sort(key=lambda s: s.total, reverse=True)
+        return sites[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.sites.clear()
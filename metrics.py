@@ -0,0 +1,317 @@
+"""
+Prometheus-style metrics for the bot.
+
+Metrics are plain in-process objects (no client library needed) rendered in
+the Prometheus text exposition format by a small aiohttp server bound to
+localhost. Cogs import the metric objects below and record into them;
+gauges that are cheaper to read than to maintain are filled in by collector
+callbacks right before each scrape.
+
+    curl http://127.0.0.1:9108/metrics
+"""
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import discord
+from aiohttp import web
+from discord import app_commands
+
+# ------------------------
+# CONFIG
+# ------------------------
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the endpoint
+
+# Seconds; covers instant replies up to slow yt-dlp extractions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ------------------------
+# METRIC TYPES
+# ------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], le: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Histograms are observed from discord.py's audio threads too
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self.values[labels] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def time(self, *labels: str):
+        """Context manager observing the wall time of its block."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self.series.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+REGISTRY: List[_Metric] = []
+COLLECTORS: List[Callable[[], None]] = []
+
+
+def add_collector(fn: Callable[[], None]):
+    """Run `fn` before every scrape (to refresh gauges)."""
+    COLLECTORS.append(fn)
+
+
+def remove_collector(fn: Callable[[], None]):
+    if fn in COLLECTORS:
+        COLLECTORS.remove(fn)
+
+
+def render() -> str:
+    for fn in list(COLLECTORS):
+        try:
+            fn()
+        except Exception as e:
+            print(f"[metrics] Collector {fn!r} failed: {e}")
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------
+# METRICS
+# ------------------------
+
+COMMAND_FIRST_RESPONSE = Histogram(
+    "jamesbot_command_first_response_seconds",
+    "Time from the interaction being created to the bot's first response (reply, defer or modal).",
+    ["command", "type"],
+)
+COMMAND_DURATION = Histogram(
+    "jamesbot_command_duration_seconds",
+    "Time from the interaction being created until its slash command handler returned.",
+    ["command", "status"],
+)
+YTDL_RESOLVE = Histogram(
+    "jamesbot_ytdl_resolve_seconds",
+    "yt-dlp extract_info time, including waiting for a resolver slot.",
+    ["profile", "outcome"],
+)
+SPOTIFY_API = Histogram(
+    "jamesbot_spotify_api_seconds",
+    "Spotify Web API call time.",
+    ["method"],
+)
+FFMPEG_FIRST_FRAME = Histogram(
+    "jamesbot_ffmpeg_first_frame_seconds",
+    "Time from spawning ffmpeg to the first audio frame being read.",
+    ["format"],
+)
+QUEUE_DEPTH = Gauge(
+    "jamesbot_music_queue_depth",
+    "Tracks queued per guild (including the one playing).",
+    ["guild"],
+)
+VOICE_SESSIONS = Gauge(
+    "jamesbot_voice_sessions",
+    "Connected voice clients.",
+)
+LOOP_LAG = Histogram(
+    "jamesbot_event_loop_lag_seconds",
+    "How late the event loop ran the lag monitor's heartbeat.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = Counter(
+    "jamesbot_event_loop_stalls_total",
+    "Loop stalls over the lag threshold, by blamed call site.",
+    ["site"],
+)
+RATE_LIMITED = Counter(
+    "jamesbot_rest_429_total",
+    "Discord REST responses with status 429.",
+    ["scope"],
+)
+
+
+# ------------------------
+# DISCORD HOOKS
+# ------------------------
+
+def interaction_label(interaction: discord.Interaction) -> str:
+    command = interaction.command
+    return command.qualified_name if command else interaction.type.name
+
+
+def interaction_age(interaction: discord.Interaction) -> float:
+    # created_at comes from the snowflake, so this includes gateway delivery
+    return (discord.utils.utcnow() - interaction.created_at).total_seconds()
+
+
+def _record_first_response(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        result = await method(self, *args, **kwargs)
+        interaction = self._parent
+        COMMAND_FIRST_RESPONSE.observe(
+            interaction_age(interaction), interaction_label(interaction), interaction.type.name,
+        )
+        return result
+    return wrapper
+
+
+class MetricsTree(app_commands.CommandTree):
+    """CommandTree that records failed commands (successes arrive via on_app_command_completion)."""
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        COMMAND_DURATION.observe(interaction_age(interaction), interaction_label(interaction), "error")
+        await super().on_error(interaction, error)
+
+
+class RateLimitHandler(logging.Handler):
+    """Counts the 429 warnings discord.py's HTTP client logs before retrying."""
+
+    def emit(self, record: logging.LogRecord):
+        if record.levelno < logging.WARNING:
+            return
+        message = record.getMessage()
+        message = message.lower()
+        if "429" in message or "rate limit" in message:
+            RATE_LIMITED.inc("global" if "global" in message else "route")
+
+
+def install(bot: discord.Client):
+    """Hook metrics into a bot whose tree is a MetricsTree."""
+    # Every first response goes through one of these, whichever cog sends it
+    for name in ("send_message", "defer", "edit_message", "send_modal", "autocomplete"):
+        method = getattr(discord.InteractionResponse, name, None)
+        if method and not getattr(method, "_metrics", False):
+            wrapped = _record_first_response(method)
+            wrapped._metrics = True
+            setattr(discord.InteractionResponse, name, wrapped)
+
+    async def on_app_command_completion(interaction: discord.Interaction, command):
+        COMMAND_DURATION.observe(interaction_age(interaction), interaction_label(interaction), "ok")
+
+    bot.add_listener(on_app_command_completion)
+
+    http_logger = logging.getLogger("discord.http")
+    http_logger.addHandler(RateLimitHandler())
+    if http_logger.getEffectiveLevel() > logging.WARNING:
+        http_logger.setLevel(logging.WARNING)
+
+    add_collector(lambda: VOICE_SESSIONS.set(len(bot.voice_clients)))
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[metrics] Serving on http://{host}:{port}/metrics")
+    return runner
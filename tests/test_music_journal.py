@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("discord")
+pytest.importorskip("spotipy")
+
+from cogs.music import Music, QueueJournal, Track, TrackQueue  # noqa: E402
+
+
+def make_track(n):
+    return Track(url=f"https://youtu.be/{n}", source_url="", title=f"Track {n}", thumbnail=None, duration=n)
+
+
+def test_track_queue_from_iterable():
+    queue = TrackQueue(make_track(n) for n in range(3))
+    assert len(queue) == 3
+    assert queue.listener is None
+    assert [t.title for t in queue] == ["Track 0", "Track 1", "Track 2"]
+
+
+def test_restore_states_round_trip(tmp_path):
+    journal = QueueJournal(str(tmp_path / "journal.log"), str(tmp_path / "journal.snap"))
+    journal.open()
+    journal.write("channels", 1, 10, 20)
+    for n in range(3):
+        journal.write("append", 1, make_track(n))
+    journal.write("pop", 1, 0)
+    journal.close()
+
+    # Only the journal and state table are needed, not the Spotify client etc.
+    cog = Music.__new__(Music)
+    cog.states = {}
+    cog.journal = QueueJournal(journal.path, journal.snapshot_path)
+    resume = cog.restore_states(cog.journal.load())
+
+    assert list(resume) == [1]
+    state = cog.states[1]
+    assert state.voice_channel_id == 10
+    assert [t.title for t in state.queue] == ["Track 1", "Track 2"]
+
+    # Mutations after the restore keep going to the journal
+    cog.journal.open()
+    state.queue.append(make_track(3))
+    cog.journal.close()
+    reloaded = QueueJournal(journal.path, journal.snapshot_path).load()
+    assert [entry[1] for entry in reloaded[1]["queue"]] == ["Track 1", "Track 2", "Track 3"]
+
+
+def test_compact_crash_before_truncate_does_not_replay(tmp_path):
+    log, snap = tmp_path / "journal.log", tmp_path / "journal.snap"
+    journal = QueueJournal(str(log), str(snap))
+    journal.load()
+    journal.open()
+    for n in range(2):
+        journal.write("append", 1, make_track(n))
+    journal.file.flush()
+    stale = log.read_bytes()
+
+    journal.compact(QueueJournal(str(log), str(snap)).load())
+    journal.close()
+    # Crash between publishing the snapshot and truncating the log
+    log.write_bytes(stale)
+
+    restored = QueueJournal(str(log), str(snap))
+    guilds = restored.load()
+    assert [entry[1] for entry in guilds[1]["queue"]] == ["Track 0", "Track 1"]
+
+    # The stale log is dropped, so new entries replay on the next start
+    restored.open()
+    restored.write("append", 1, make_track(2))
+    restored.close()
+    guilds = QueueJournal(str(log), str(snap)).load()
+    assert [entry[1] for entry in guilds[1]["queue"]] == ["Track 0", "Track 1", "Track 2"]